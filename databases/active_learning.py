@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+
+from ase.io import read
+from collections import defaultdict
+import yaml
+import numpy as np
+import os
+from datagenerator import (
+    create_parser as create_datagenerator_parser,
+    run_jobs,
+    bigdft_job,
+    abinit_job,
+)
+from dbcreator import read_files, read_bigdft, read_abinit, filter_ingested
+from utils.database import BulkWriter, IngestionIndex
+from utils.datagen import RandomDisplacements, committee_scores, select_most_uncertain
+from utils.global_variables import DEFAULT_METADATA
+from utils.jobs import JobDirectory, JobManifest, ResultSink
+from utils.jobs.backends import (
+    get_abinit_calculator,
+    posinp_to_atoms,
+    read_input_params,
+)
+
+
+def create_parser():
+    parser = create_datagenerator_parser()
+    parser.description = (
+        "Generates n_candidates random structures, scores them with a committee "
+        "of models and calculates the n_structs most uncertain ones."
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        required=True,
+        help="Paths to the trained models of the committee.",
+    )
+    parser.add_argument(
+        "--n_candidates",
+        type=int,
+        default=10000,
+        help="Number of candidate structures scored by the committee.",
+    )
+    parser.add_argument(
+        "--offset",
+        type=int,
+        default=0,
+        help="Index of the first candidate. Use a new offset with the same "
+        "seed at each round to draw new candidates.",
+    )
+    parser.add_argument(
+        "--property",
+        choices=["energy", "forces"],
+        default="forces",
+        help="Property whose committee standard deviation scores the candidates.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=256,
+        help="Number of candidates evaluated together by the models.",
+    )
+    parser.add_argument("--cuda", help="Use GPU for evaluation", action="store_true")
+    parser.add_argument(
+        "--dbname",
+        default=None,
+        help="Database where the new calculations are ingested, if given.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing the output files.",
+    )
+    return parser
+
+
+def main(args):
+    from mlcalcdriver.calculators import EnsembleCalculator
+
+    # Create directories
+    os.makedirs("run_dir/", exist_ok=True)
+    os.makedirs("saved_results/", exist_ok=True)
+    manifest = JobManifest()
+    sink = ResultSink(args.results_db, cleanup=args.cleanup)
+
+    if args.run_mode == "bigdft":
+        from mybigdft import Posinp
+
+        jobname = args.posinp.split(".")[0]
+        initpos = Posinp.from_file(args.posinp)
+        initatoms = posinp_to_atoms(initpos)
+        # The candidates are displaced in the units of the posinp, like the jobs
+        structure = initpos
+        result_name = "{:06}.xyz"
+    elif args.run_mode == "abinit":
+        jobname = args.positions.split(".")[0]
+        initatoms = read(args.positions, format="abinit-in")
+        structure = initatoms
+        result_name = "{:06}.out"
+    else:
+        raise ValueError("The run_mode argument should be abinit or bigdft.")
+
+    displacements = RandomDisplacements(len(initatoms), seed=args.seed)
+    print("Random seed: {}".format(displacements.seed))
+
+    # Candidates already calculated are not scored again
+    done = manifest.completed()
+    candidates = np.array(
+        [
+            i
+            for i in range(args.offset, args.offset + args.n_candidates)
+            if "{}_{:06}".format(jobname, i) not in done
+        ],
+        dtype=int,
+    )
+    device = "cuda" if args.cuda else "cpu"
+    calculator = EnsembleCalculator(args.models, device=device)
+    scores = committee_scores(
+        structure,
+        displacements,
+        candidates,
+        calculator,
+        args.property,
+        batch_size=args.batch_size,
+    )
+    selected = select_most_uncertain(candidates, scores, args.n_structs)
+    np.savez(
+        "active_learning_{:06}.npz".format(args.offset),
+        candidates=candidates,
+        scores=scores,
+        selected=selected,
+        seed=str(displacements.seed),
+    )
+    print(
+        "Selected the {} most uncertain of {} candidates.".format(
+            len(selected), len(candidates)
+        )
+    )
+
+    if args.run_mode == "bigdft":
+        inputpar = read_input_params(args.backend)
+        tasks = [
+            (i, initpos, displacements, args, jobname, inputpar, manifest, sink)
+            for i in selected
+        ]
+        function, reader = bigdft_job, read_bigdft
+    else:
+        with open(args.input, "r") as f:
+            inputs = yaml.load(f, Loader=yaml.BaseLoader)
+        abinit_calculator = get_abinit_calculator(args.backend)
+        tasks = [
+            (
+                i,
+                inputs,
+                initatoms,
+                displacements,
+                jobname,
+                manifest,
+                sink,
+                abinit_calculator,
+            )
+            for i in selected
+        ]
+        function, reader = abinit_job, read_abinit
+
+    try:
+        run_jobs(function, tasks, args, nmpi=args.nmpi)
+    finally:
+        # The completed calculations are ingested even if some jobs failed
+        if args.dbname is not None:
+            files = [
+                JobDirectory(
+                    "{}_{:06}".format(jobname, i), result_name.format(i)
+                ).result_path
+                for i in selected
+            ]
+            ingest([f for f in files if os.path.exists(f)], reader, args)
+
+
+def ingest(files, reader, args):
+    r"""
+    Writes the results of the calculations to the database, like
+    dbcreator.py in append mode.
+    """
+    index = IngestionIndex(args.dbname)
+    rows = defaultdict(list)
+    with BulkWriter(args.dbname, metadata=DEFAULT_METADATA) as writer:
+        files = filter_ingested(files, index, writer)
+        for f, (atoms, data) in zip(files, read_files(files, reader, args.workers)):
+            rows[f].append(writer.write(atoms, data=data, source=f))
+
+    # Only index the rows once they are committed
+    for f, ids in rows.items():
+        index.record(f, ids)
+    index.save()
+
+
+if __name__ == "__main__":
+    parser = create_parser()
+    args = parser.parse_args()
+    main(args)
@@ -3,7 +3,7 @@
 import sys
 import argparse
 import numpy as np
-from ase.db import connect
+from utils.database import bulk_write
 from mlcalcdriver import Posinp
 from mlcalcdriver.interfaces import posinp_to_ase_atoms
 
@@ -11,23 +11,26 @@ from mlcalcdriver.interfaces import posinp_to_ase_atoms
 def main(args):
     function = get_function(args.function)
     distances = np.linspace(args.range[0], args.range[1], args.ndata)
-    with connect(args.dbname) as db:
-        for d in distances:
-            pos_dict = {
-                "units": "angstroem",
-                "boundary_conditions": "free",
-                "positions": [{args.element: [0, 0, 0]}, {args.element: [d, 0, 0]},],
-            }
-            posinp = Posinp.from_dict(pos_dict)
-            atoms = posinp_to_ase_atoms(posinp)
-            energy = function.value(d)
-            forces = np.array(
-                [
-                    [-1.0 * function.first_derivative(-d), 0, 0],
-                    [-1.0 * function.first_derivative(d), 0, 0],
-                ]
-            )
-            db.write(atoms, data={"energy": energy, "forces": forces})
+    bulk_write(args.dbname, get_rows(function, distances, args.element))
+
+
+def get_rows(function, distances, element):
+    for d in distances:
+        pos_dict = {
+            "units": "angstroem",
+            "boundary_conditions": "free",
+            "positions": [{element: [0, 0, 0]}, {element: [d, 0, 0]},],
+        }
+        posinp = Posinp.from_dict(pos_dict)
+        atoms = posinp_to_ase_atoms(posinp)
+        energy = function.value(d)
+        forces = np.array(
+            [
+                [-1.0 * function.first_derivative(-d), 0, 0],
+                [-1.0 * function.first_derivative(d), 0, 0],
+            ]
+        )
+        yield atoms, {"energy": energy, "forces": forces}
 
 
 def create_parser():
@@ -1,16 +1,25 @@
 #! /usr/bin/env python
 
-from mybigdft import Posinp, InputParams, Job, Logfile
-from mybigdft.workflows import Geopt
-from abipy.abio.outputs import AbinitOutputFile
 from ase.io import read
-from ase.calculators.abinit import Abinit
-from shutil import rmtree, copyfile
-from copy import deepcopy
 import yaml
-import numpy as np
 import argparse
 import os
+from utils.datagen import RandomDisplacements, displaced_posinp, displaced_atoms
+from utils.jobs import (
+    CLEANUP_MODES,
+    JobDirectory,
+    JobManifest,
+    ResultSink,
+    SlotScheduler,
+)
+from utils.jobs.backends import (
+    BACKENDS,
+    BACKEND_HELP,
+    get_bigdft_job,
+    get_abinit_calculator,
+    read_input_params,
+    run_bigdft_job,
+)
 
 
 def create_parser():
@@ -23,6 +32,44 @@ def create_parser():
         type=int,
         help="Number of different structures to generate and calculate.",
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random displacements. Structure i is the same "
+        "for a given seed, so restarted jobs are reproducible.",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores shared by concurrent jobs. "
+        "If not given, the jobs run one after another.",
+    )
+    parser.add_argument(
+        "--nomp",
+        type=int,
+        default=1,
+        help="Number of OpenMP threads per mpi process, with --cores.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="dft",
+        help=BACKEND_HELP,
+    )
+    parser.add_argument(
+        "--results_db",
+        default=None,
+        help="Database where the energy and forces of each job are written "
+        "as soon as it finishes.",
+    )
+    parser.add_argument(
+        "--cleanup",
+        choices=CLEANUP_MODES,
+        default="keep",
+        help="What to do with the directory of a finished job.",
+    )
     runmode_subparser = parser.add_subparsers(
         dest="run_mode", help="Choose the DFT code to generate data."
     )
@@ -55,6 +102,13 @@ def create_parser():
         "positions", help="Name of the initial positions file(abinit format)"
     )
     abinit_parser.add_argument("input", help="Name of the yaml input file.")
+    abinit_parser.add_argument(
+        "--nmpi",
+        help="Number of mpi processes used by the Abinit command, "
+        "to size the slots with --cores.",
+        type=int,
+        default=1,
+    )
     return parser
 
 
@@ -62,134 +116,134 @@ def main(args):
     # Create directories
     os.makedirs("run_dir/", exist_ok=True)
     os.makedirs("saved_results/", exist_ok=True)
+    manifest = JobManifest()
+    sink = ResultSink(args.results_db, cleanup=args.cleanup)
 
     if args.run_mode == "bigdft":
+        from mybigdft import Posinp
+
         jobname = args.posinp.split(".")[0]
         initpos = Posinp.from_file(args.posinp)
 
-        inputpar = InputParams()
-        for filename in [f for f in os.listdir() if f.endswith(".yaml")]:
-            try:
-                inputpar = InputParams.from_file(filename)
-                break
-            except:
-                continue
-
-        os.chdir("run_dir/")
-        for i in range(args.n_structs):
-            try:
-                os.makedirs("{}_{:06}".format(jobname, i))
-                os.chdir("{}_{:06}".format(jobname, i))
-                bigdft_run(i, initpos, args, jobname, inputpar, restart=False)
-            except OSError:
-                os.chdir("{}_{:06}".format(jobname, i))
-                try:
-                    log = Logfile.from_file("log-" + jobname + ".yaml")
-                    print("Calculation {:06} was complete.\n".format(i))
-                    os.chdir("../")
-                except:
-                    bigdft_run(i, initpos, args, jobname, inputpar, restart=True)
-        os.chdir("../")
+        inputpar = read_input_params(args.backend)
+
+        displacements = RandomDisplacements(len(initpos), seed=args.seed)
+        print("Random seed: {}".format(displacements.seed))
+        tasks = [
+            (i, initpos, displacements, args, jobname, inputpar, manifest, sink)
+            for i in pending_indices(manifest, jobname, args.n_structs)
+        ]
+        run_jobs(bigdft_job, tasks, args, nmpi=args.nmpi)
 
     elif args.run_mode == "abinit":
         jobname = args.positions.split(".")[0]
         initatoms = read(args.positions, format="abinit-in")
         with open(args.input, "r") as f:
             inputs = yaml.load(f, Loader=yaml.BaseLoader)
-        calculator = Abinit(**inputs)
-
-        os.chdir("run_dir/")
-        for i in range(args.n_structs):
-            try:
-                os.makedirs("{}_{:06}".format(jobname, i))
-                os.chdir("{}_{:06}".format(jobname, i))
-                abinit_run(i, calculator, initatoms)
-            except FileExistsError:
-                os.chdir("{}_{:06}".format(jobname, i))
-                try:
-                    about = AbinitOutputFile("abinit.out")
-                    if about.run_completed:
-                        print("Calculation {:06} was complete.\n".format(i))
-                        os.chdir("../")
-                    else:
-                        restart(i, calculator, initatoms)
-                except:
-                    restart(i, calculator, initatoms)
+
+        displacements = RandomDisplacements(len(initatoms), seed=args.seed)
+        print("Random seed: {}".format(displacements.seed))
+        calculator = get_abinit_calculator(args.backend)
+        tasks = [
+            (i, inputs, initatoms, displacements, jobname, manifest, sink, calculator)
+            for i in pending_indices(manifest, jobname, args.n_structs)
+        ]
+        run_jobs(abinit_job, tasks, args, nmpi=args.nmpi)
     else:
         raise ValueError("The run_mode argument should be abinit or bigdft.")
 
-def bigdft_run(i, initpos, args, jobname, inputpar, restart=False):
-    pos = bigdft_random_structure(initpos)
+
+def run_jobs(function, tasks, args, nmpi=1):
+    if args.cores is None:
+        for task in tasks:
+            function(*task)
+    else:
+        scheduler = SlotScheduler(n_cores=args.cores, nmpi=nmpi, nomp=args.nomp)
+        scheduler.run(function, tasks)
+
+
+def pending_indices(manifest, jobname, n_structs):
+    done = manifest.completed()
+    indices = [
+        i for i in range(n_structs) if "{}_{:06}".format(jobname, i) not in done
+    ]
+    print(
+        "{} calculations completed, {} to run.".format(
+            n_structs - len(indices), len(indices)
+        )
+    )
+    return indices
+
+
+def bigdft_job(i, initpos, displacements, args, jobname, inputpar, manifest, sink):
+    workdir = JobDirectory("{}_{:06}".format(jobname, i), "{:06}.xyz".format(i))
+    track = manifest.track(workdir.name, i, displacements.seed, workdir.result_path)
+    output = "forces_{}.xyz".format(jobname)
+    if workdir.create():
+        pos = displaced_posinp(initpos, displacements[i])
+        with track:
+            bigdft_run(workdir, pos, args, jobname, inputpar, restart=False)
+            sink.collect(workdir, output, "bigdft", idx=i)
+    elif workdir.bigdft_completed(jobname):
+        # Jobs completed before the manifest existed
+        sink.collect(workdir, output, "bigdft", idx=i)
+        manifest.set_completed(workdir.name, i, displacements.seed, workdir.result_path)
+        print("Calculation {:06} was complete.\n".format(i))
+    else:
+        pos = displaced_posinp(initpos, displacements[i])
+        with track:
+            bigdft_run(workdir, pos, args, jobname, inputpar, restart=True)
+            sink.collect(workdir, output, "bigdft", idx=i)
+
+
+def abinit_job(
+    i, inputs, initatoms, displacements, jobname, manifest, sink, calculator
+):
+    workdir = JobDirectory("{}_{:06}".format(jobname, i), "{:06}.out".format(i))
+    track = manifest.track(workdir.name, i, displacements.seed, workdir.result_path)
+    if workdir.create():
+        with track:
+            abinit_run(i, workdir, inputs, initatoms, displacements, calculator)
+            sink.collect(workdir, "abinit.out", "abinit", idx=i)
+    elif workdir.abinit_completed():
+        # Jobs completed before the manifest existed
+        sink.collect(workdir, "abinit.out", "abinit", idx=i)
+        manifest.set_completed(workdir.name, i, displacements.seed, workdir.result_path)
+        print("Calculation {:06} was complete.\n".format(i))
+    else:
+        with track:
+            restart(i, workdir, inputs, initatoms, displacements, calculator)
+            sink.collect(workdir, "abinit.out", "abinit", idx=i)
+
+
+def bigdft_run(workdir, pos, args, jobname, inputpar, restart=False):
+    Job = get_bigdft_job(args.backend)
     job = Job(
         name=jobname,
         posinp=pos,
         inputparams=inputpar,
         pseudos=args.no_pseudos,
+        run_dir=workdir.path,
     )
-    job.run(nmpi=args.nmpi, restart_if_incomplete=restart)
-    copyfile(
-        "forces_{}.xyz".format(jobname),
-        "../../saved_results/{:06}.xyz".format(i),
-    )
-    os.chdir("../")
-
-def bigdft_random_structure(initpos):
-    pos = deepcopy(initpos)
-    atoms_idx = np.arange(len(pos))
-    n_translations = np.random.randint(len(pos)) + 1
-    trans_idx = np.random.choice(atoms_idx, n_translations)
-    for j in trans_idx:
-        phi = 2 * np.pi * np.random.rand()
-        theta = np.arccos(2 * np.random.rand() - 1)
-        r = -0.1
-        while r < 0:
-            r = np.random.normal(scale=0.1)
-        pos = pos.translate_atom(
-            j,
-            [
-                r * np.sin(theta) * np.cos(phi),
-                r * np.sin(theta) * np.sin(phi),
-                r * np.cos(theta),
-            ],
-        )
-    return pos
+    run_bigdft_job(job, nmpi=args.nmpi, restart_if_incomplete=restart)
+    workdir.save("forces_{}.xyz".format(jobname))
+
 
-def restart(i, calculator, initatoms):
-    for f in os.listdir():
-        os.remove(f)
-    abinit_run(i, calculator, initatoms)
+def restart(i, workdir, inputs, initatoms, displacements, calculator):
+    workdir.clear()
+    abinit_run(i, workdir, inputs, initatoms, displacements, calculator)
 
-def abinit_run(i, calculator, initatoms):
-    at = abinit_random_structure(initatoms)
-    at.set_calculator(calculator)
+
+def abinit_run(i, workdir, inputs, initatoms, displacements, calculator):
+    at = displaced_atoms(initatoms, displacements[i])
+    at.set_calculator(calculator(label=workdir.file("abinit"), **inputs))
     at.get_forces()
-    os.rename("abinit.txt", "abinit.out")
-    copyfile("abinit.out", "../../saved_results/{:06}.out".format(i))
-    for f in os.listdir():
+    os.rename(workdir.file("abinit.txt"), workdir.file("abinit.out"))
+    workdir.save("abinit.out")
+    for f in os.listdir(workdir.path):
         if f.startswith("abinito_"):
-            os.remove(f)
+            os.remove(workdir.file(f))
     print("Calculation {:06} completed.\n".format(i))
-    os.chdir("../")
-
-def abinit_random_structure(initatoms):
-    at = deepcopy(initatoms)
-    atoms_idx = np.arange(len(at))
-    n_translations = np.random.randint(len(at)) + 1
-    trans_idx = np.random.choice(atoms_idx, n_translations)
-    for j in trans_idx:
-        phi = 2 * np.pi * np.random.rand()
-        theta = np.arccos(2 * np.random.rand() - 1)
-        r = -0.1
-        while r < 0:
-            r = np.random.normal(scale=0.1)
-        at.positions[j] = at.positions[j] + np.array(
-            [
-                r * np.sin(theta) * np.cos(phi),
-                r * np.sin(theta) * np.sin(phi),
-                r * np.cos(theta),
-            ]
-        )
-    return at
 
 
 if __name__ == "__main__":
@@ -4,13 +4,17 @@ import argparse
 import ase
 import numpy as np
 import os
-import random
 import sys
-from ase.db import connect
+from collections import Counter, defaultdict
+from multiprocessing import Pool
 from ase.io import read
 from ase.units import Bohr
-from mlcalcdriver import Posinp
-from mlcalcdriver.interfaces import posinp_to_ase_atoms
+from utils.database import BulkWriter, IngestionIndex
+from utils.parsers import (
+    read_abinit_output,
+    read_bigdft_forces,
+    bigdft_forces_to_atoms,
+)
 from utils.global_variables import DEFAULT_METADATA, DEFAULT_MD_METADATA
 
 
@@ -31,201 +35,467 @@ def create_parser():
         default=None,
         help="Only for radnet",
     )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=100,
+        help="Number of structures written to the h5 file at once. Only for radnet.",
+    )
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="Append to an existing h5 group, skipping the files it already "
+        "contains. Only for radnet.",
+    )
+    parser.add_argument(
+        "--append",
+        default=False,
+        action="store_true",
+        help="Only write the files that are new or changed since the last run, "
+        "using the index saved next to the database.",
+    )
     parser.add_argument(
         "--n_equil",
         type=int,
         default=0,
-        help="Number of time the equilibrium structure is added to the dataset.",
+        help="Number of time the equilibrium structure is added to the dataset. "
+        "The structure is written once, with this multiplicity. For radnet, "
+        "radnet_conversion.py applies it when converting the h5 file.",
     )
     parser.add_argument(
         "--n_relaxed",
         type=int,
         default=0,
-        help="Number of time the relaxation structures are added to the dataset.",
+        help="Number of time the relaxation structures are added to the dataset. "
+        "The structures are written once, with this multiplicity.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to parse the output files. "
+        "Not used for radnet.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the permutation of the output files. Only for radnet.",
+    )
+    parser.add_argument(
+        "--source",
+        default=False,
+        action="store_true",
+        help="If used, each row gets a source key with the name of its output "
+        "file, used by the source strategy of dbsplitter.py. Not used for radnet.",
     )
     return parser
 
 
+def source_key(args, filename):
+    r"""
+    Returns the key-value pair naming the output file of a row,
+    empty if --source is not used.
+    """
+    return {"source": filename} if args.source else {}
+
+
 def main(args):
     if args.run_mode in ["bigdft", "abinit", "md"]:
-        with connect(args.dbname) as db:
+        index = IngestionIndex(args.dbname)
+        rows = defaultdict(list)
+        metadata = DEFAULT_MD_METADATA if args.run_mode == "md" else DEFAULT_METADATA
+        with BulkWriter(args.dbname, metadata=metadata) as writer:
             if args.run_mode == "bigdft":
-                db.metadata = DEFAULT_METADATA
-                files = [f for f in os.listdir() if f.endswith(".xyz")]
-                for f in files:
-                    atoms = posinp_to_ase_atoms(Posinp.from_file(f))
-                    with open(f, "r") as posinp_file:
-                        energy = float(posinp_file.readline().split()[2]) * 27.21138602
-                        forces = None
-                        for line in posinp_file:
-                            if "forces" not in line:
-                                continue
-                            else:
-                                forces = []
-                                for _ in range(len(atoms)):
-                                    forces.append(
-                                        [
-                                            float(force)
-                                            for force in posinp_file.readline().split()[
-                                                -3:
-                                            ]
-                                        ]
-                                    )
-                                forces = np.array(forces) * 27.21138602 / 0.529177249
-                                break
-                    db.write(atoms, data={"energy": energy, "forces": forces})
+                files = sorted([f for f in os.listdir() if f.endswith(".xyz")])
+                if args.append:
+                    files = filter_ingested(files, index, writer)
+                for f, (atoms, data) in zip(
+                    files, read_files(files, read_bigdft, args.workers)
+                ):
+                    rows[f].append(
+                        writer.write(atoms, data=data, **source_key(args, f))
+                    )
 
             elif args.run_mode == "abinit":
-                from abipy.abio.outputs import AbinitOutputFile
-
-                db.metadata = DEFAULT_METADATA
-                files = [
-                    f for f in os.listdir() if f.endswith(".out") or f.endswith(".abo")
-                ]
+                files = sorted(
+                    [
+                        f
+                        for f in os.listdir()
+                        if f.endswith(".out") or f.endswith(".abo")
+                    ]
+                )
+                # Replicated structures are written once, with a multiplicity
+                multiplicities = {}
                 if args.n_equil > 0:
                     if os.path.exists("equil.out"):
-                        for _ in range(args.n_equil - 1):
-                            files.append("equil.out")
-                        random.shuffle(files)
+                        multiplicities["equil.out"] = args.n_equil
                     else:
                         raise FileNotFoundError(
                             "The equilibrium positions should be in 'equil.out'."
                         )
                 if args.n_relaxed > 0:
-                    relaxed_files = [
-                        f
-                        for f in os.listdir()
-                        if f.startswith("relax") and f.endswith(".xyz")
-                    ]
+                    relaxed_files = sorted(
+                        [
+                            f
+                            for f in os.listdir()
+                            if f.startswith("relax") and f.endswith(".xyz")
+                        ]
+                    )
                     if len(relaxed_files) == 0:
                         raise FileNotFoundError(
                             "The relaxation positions should be given in relax_X.xyz files."
                         )
                     else:
+                        if args.append:
+                            relaxed_files = filter_ingested(
+                                relaxed_files, index, writer
+                            )
                         for rf in relaxed_files:
                             atoms = read(rf, format="extxyz")
                             energy = atoms.info["energy"]
                             forces = atoms.info["forces"]
-                            for _ in range(args.n_relaxed):
-                                db.write(
-                                    atoms, data={"energy": energy, "forces": forces}
+                            rows[rf].append(
+                                writer.write(
+                                    atoms,
+                                    data={"energy": energy, "forces": forces},
+                                    multiplicity=args.n_relaxed,
+                                    **source_key(args, rf),
                                 )
+                            )
 
-                for f in files:
-                    atoms = read(f, format="abinit-out")
-                    about = AbinitOutputFile(f)
-                    energy = float(about.final_vars_global["etotal"]) * 27.21138602
-                    forces = (
-                        np.array(
-                            [float(g) for g in about.final_vars_global["fcart"].split()]
-                        ).reshape(-1, 3)
-                        * 27.21138602
-                        / 0.529177249
-                    )
-                    db.write(atoms, data={"energy": energy, "forces": forces})
+                if args.append:
+                    files = filter_ingested(files, index, writer)
+                for f, (atoms, data) in zip(
+                    files, read_files(files, read_abinit, args.workers)
+                ):
+                    if f in multiplicities:
+                        rows[f].append(
+                            writer.write(
+                                atoms,
+                                data=data,
+                                multiplicity=multiplicities[f],
+                                **source_key(args, f),
+                            )
+                        )
+                    else:
+                        rows[f].append(
+                            writer.write(atoms, data=data, **source_key(args, f))
+                        )
 
             elif args.run_mode == "md":
-                db.metadata = DEFAULT_MD_METADATA
-                files = [f for f in os.listdir() if f.endswith(".xyz")]
-                for i, f in enumerate(files):
-                    atoms = read(f, format="extxyz")
-                    energy = atoms.get_total_energy()
-                    forces = atoms.get_forces()
-                    db.write(atoms, data={"energy": energy, "forces": forces})
+                files = sorted([f for f in os.listdir() if f.endswith(".xyz")])
+                if args.append:
+                    files = filter_ingested(files, index, writer)
+                for f, (atoms, data) in zip(
+                    files, read_files(files, read_md, args.workers)
+                ):
+                    rows[f].append(
+                        writer.write(atoms, data=data, **source_key(args, f))
+                    )
+
+        # Only index the rows once they are committed
+        for f, ids in rows.items():
+            index.record(f, ids)
+        index.save()
 
     elif args.run_mode in ["radnet"]:
         assert args.target is not None
-        from abipy.abio.outputs import AbinitOutputFile
         import h5py
 
         h5FileName = args.dbname if args.dbname.endswith(".h5") else args.dbname + ".h5"
-        with h5py.File(h5FileName, "w") as outfile:
-            files = sorted(
-                [f for f in os.listdir() if f.endswith(".out") or f.endswith(".abo")]
-            )
-
-            # Adding equilibrium structure multiple times
-            if args.n_equil > 0:
-                if os.path.exists("equil.out"):
-                    for _ in range(args.n_equil - 1):
-                        files.append("equil.out")
-                else:
-                    raise FileNotFoundError(
-                        "The equilibrium positions should be in 'equil.out'."
-                    )
+        files = sorted(
+            [f for f in os.listdir() if f.endswith(".out") or f.endswith(".abo")]
+        )
+
+        # Equilibrium structure is written once, with a multiplicity
+        multiplicities = {}
+        if args.n_equil > 0:
+            if os.path.exists("equil.out"):
+                multiplicities["equil.out"] = args.n_equil
+            else:
+                raise FileNotFoundError(
+                    "The equilibrium positions should be in 'equil.out'."
+                )
 
-            random.shuffle(files)  # Useful if we split the database later on
-            # Get common values between structures
-            ref = read(files[0], format="abinit-out")
-            natoms = len(ref)
-            atomic_numbers = ref.get_atomic_numbers()
-            cell = ref.cell
+        # Seeded permutation, useful if we split the database later on
+        order = np.random.default_rng(args.seed).permutation(len(files))
+        files = [files[i] for i in order]
+        all_files = list(files)
+        index = IngestionIndex(h5FileName)
+        resume = args.resume or args.append
+        if not resume:
+            # The rows of an earlier run are overwritten with the file
+            index.clear()
+        with h5py.File(h5FileName, "a" if resume else "w") as outfile:
+            if args.h5group in outfile:
+                # Skip the files that are already in the group
+                group = outfile[args.h5group]
+                if (
+                    "filenames" not in group
+                    or group["coordinates"].maxshape[0] is not None
+                ):
+                    raise ValueError(
+                        "The group '{}' of {} was written by an older version "
+                        "and cannot be resumed or appended to. Write it again "
+                        "without --resume and --append.".format(
+                            args.h5group, h5FileName
+                        )
+                    )
+                done = Counter(
+                    [
+                        name.decode() if isinstance(name, bytes) else name
+                        for name in group["filenames"][:]
+                    ]
+                )
+                remaining = []
+                for f in files:
+                    if done[f] > 0:
+                        done[f] -= 1
+                    else:
+                        remaining.append(f)
+                files = remaining
+                cell = group["cell"][:]
+            else:
+                # Get common values between structures
+                ref = read(files[0], format="abinit-out")
+                cell = ref.cell.array
+                group = create_radnet_group(
+                    outfile, args.h5group, ref, chunk_size=args.flush_every
+                )
             au_cell = cell / Bohr
-            au_volume = cell.volume / (Bohr**3)
-
-            # Prepare arrays
-            coordinates = np.empty((len(files), natoms, 3))
-            dielectric = np.empty((len(files), 3, 3))
-            polarization = np.empty((len(files), 3))
-            polarization_phases = np.empty((len(files), 3))
-
-            # Loop on output files
-            for i, f in enumerate(files):
-                atoms = read(f, format="abinit-out")
-                coordinates[i] = atoms.get_positions()
-
-                about = AbinitOutputFile(f)
-
-                # Read dielectric values
-                die_data = about.datasets[3].split("\n")
-                for j, line in enumerate(die_data):
-                    if "Dielectric" in line:
-                        die_results_idx = j
-
-                die_values = []
-                for offset in [4, 5, 6, 8, 9, 10, 12, 13, 14]:
-                    die_values.append(die_data[die_results_idx + offset].split()[4])
-                dielectric[i] = np.array(die_values).reshape(3, 3)
-
-                # Read polarization values
-                pol_data = about.datasets[4].split("\n")
-                idx_list = []
-                for j, line in enumerate(pol_data):
-                    if "Electronic Berry phase" in line:
-                        idx_list.append(j)
-
-                # Unfold Berry phase to get continuous distribution
-                pol_values = []
-                for idx in idx_list:
-                    p_elec = float(pol_data[idx].split()[3])
-                    p_ion = float(pol_data[idx + 1].split()[2])
-                    p_ion = 2 + p_ion if p_ion < 0 else p_ion
-                    pol_values.append((p_elec + p_ion))
-                polarization_phases[i] = np.array(pol_values)
-                pol_values = np.broadcast_to(np.array(pol_values), (3, 3)).T
-                polarization[i] = (pol_values * au_cell).sum(0) / au_volume
-
-            # Save targets
-            if args.target == "polarization":
-                target = polarization
-            elif args.target == "dielectric":
-                target = np.empty((len(files), 6))
-                target[:, 0] = dielectric[:, 0, 0]
-                target[:, 1] = dielectric[:, 0, 1]
-                target[:, 2] = dielectric[:, 0, 2]
-                target[:, 3] = dielectric[:, 1, 1]
-                target[:, 4] = dielectric[:, 1, 2]
-                target[:, 5] = dielectric[:, 2, 2]
-
-            # Final write
-            group = outfile.create_group(args.h5group)
-            group.create_dataset("atomic_numbers", data=atomic_numbers)
-            group.create_dataset("cell", data=cell.array)
-            group.create_dataset("coordinates", data=coordinates)
-            group.create_dataset("dielectric", data=dielectric)
-            group.create_dataset("polarization", data=polarization)
-            group.create_dataset("polarization_phases", data=polarization_phases)
-            group.create_dataset("target", data=target)
+            au_volume = abs(np.linalg.det(cell)) / (Bohr**3)
+
+            # Overwrite the rows of the files that changed since last time
+            if args.append:
+                for f in sorted(set(all_files)):
+                    if f in index and index.needs_update(f):
+                        old_rows = index.rows(f)
+                        values = (f,) + read_radnet(f, au_cell, au_volume)
+                        set_radnet_rows(
+                            group, old_rows, [values] * len(old_rows), args.target
+                        )
+                        index.record(f, old_rows)
+
+            # Loop on output files, writing every flush_every structures
+            buffer = []
+            for f in files:
+                buffer.append((f,) + read_radnet(f, au_cell, au_volume))
+                if len(buffer) == args.flush_every:
+                    flush_radnet_rows(
+                        outfile, group, buffer, args.target, index, multiplicities
+                    )
+                    buffer = []
+            if buffer:
+                flush_radnet_rows(
+                    outfile, group, buffer, args.target, index, multiplicities
+                )
+        index.save()
+
+
+def filter_ingested(files, index, writer=None):
+    r"""
+    Keeps the files that are new or changed since they were indexed.
+    The rows previously written for changed files are overwritten by
+    the next rows of the writer, so the ids of the database stay
+    contiguous, as schnetpack expects.
+    """
+    updated = set([f for f in set(files) if index.needs_update(f)])
+    if writer is not None:
+        writer.replace([row for f in sorted(updated) for row in index.rows(f)])
+    return [f for f in files if f in updated]
+
+
+def flush_radnet_rows(outfile, group, buffer, target_name, index, multiplicities):
+    start = append_radnet_rows(group, buffer, target_name, multiplicities)
+    outfile.flush()
+    rows = defaultdict(list)
+    for i, values in enumerate(buffer):
+        rows[values[0]].append(start + i)
+    for f, new_rows in rows.items():
+        index.record(f, index.rows(f) + new_rows)
+    index.save()
+
+
+def create_radnet_group(outfile, name, ref, chunk_size=100):
+    import h5py
+
+    natoms = len(ref)
+    group = outfile.create_group(name)
+    group.create_dataset("atomic_numbers", data=ref.get_atomic_numbers())
+    group.create_dataset("cell", data=ref.cell.array)
+
+    shapes = {
+        "coordinates": (natoms, 3),
+        "dielectric": (3, 3),
+        "polarization": (3,),
+        "polarization_phases": (3,),
+    }
+    for prop, shape in shapes.items():
+        group.create_dataset(
+            prop,
+            shape=(0,) + shape,
+            maxshape=(None,) + shape,
+            chunks=(chunk_size,) + shape,
+            dtype=np.float64,
+            compression="gzip",
+        )
+    group.create_dataset(
+        "filenames",
+        shape=(0,),
+        maxshape=(None,),
+        chunks=(chunk_size,),
+        dtype=h5py.string_dtype(),
+    )
+    group.create_dataset(
+        "multiplicity",
+        shape=(0,),
+        maxshape=(None,),
+        chunks=(chunk_size,),
+        dtype=np.int64,
+    )
+    return group
+
+
+def append_radnet_rows(group, rows, target_name, multiplicities=None):
+    multiplicities = {} if multiplicities is None else multiplicities
+    filenames, coordinates, dielectric, polarization, polarization_phases = zip(*rows)
+    dielectric = np.array(dielectric)
+    polarization = np.array(polarization)
+    values = {
+        "coordinates": np.array(coordinates),
+        "dielectric": dielectric,
+        "polarization": polarization,
+        "polarization_phases": np.array(polarization_phases),
+        "target": radnet_target(dielectric, polarization, target_name),
+        "filenames": np.array(filenames, dtype=object),
+        "multiplicity": np.array([multiplicities.get(f, 1) for f in filenames]),
+    }
+    if "target" not in group:
+        # The target width depends on the target name
+        width = values["target"].shape[1]
+        group.create_dataset(
+            "target",
+            shape=(0, width),
+            maxshape=(None, width),
+            chunks=(group["coordinates"].chunks[0], width),
+            dtype=np.float64,
+            compression="gzip",
+        )
+
+    n_old, n_new = len(group["coordinates"]), len(rows)
+    if "multiplicity" not in group:
+        # Groups written before multiplicities were stored
+        group.create_dataset(
+            "multiplicity",
+            data=np.ones(n_old, dtype=np.int64),
+            maxshape=(None,),
+            chunks=(group["coordinates"].chunks[0],),
+        )
+    for prop, value in values.items():
+        dataset = group[prop]
+        dataset.resize(n_old + n_new, axis=0)
+        dataset[n_old:] = value
+    return n_old
+
+
+def set_radnet_rows(group, indices, rows, target_name):
+    filenames, coordinates, dielectric, polarization, polarization_phases = zip(*rows)
+    dielectric = np.array(dielectric)
+    polarization = np.array(polarization)
+    target = radnet_target(dielectric, polarization, target_name)
+    for i, idx in enumerate(indices):
+        group["coordinates"][idx] = coordinates[i]
+        group["dielectric"][idx] = dielectric[i]
+        group["polarization"][idx] = polarization[i]
+        group["polarization_phases"][idx] = polarization_phases[i]
+        group["target"][idx] = target[i]
+
+
+def radnet_target(dielectric, polarization, target_name):
+    if target_name == "polarization":
+        target = polarization
+    elif target_name == "dielectric":
+        target = np.empty((len(dielectric), 6))
+        target[:, 0] = dielectric[:, 0, 0]
+        target[:, 1] = dielectric[:, 0, 1]
+        target[:, 2] = dielectric[:, 0, 2]
+        target[:, 3] = dielectric[:, 1, 1]
+        target[:, 4] = dielectric[:, 1, 2]
+        target[:, 5] = dielectric[:, 2, 2]
+    return target
+
+
+def read_radnet(f, au_cell, au_volume):
+    from abipy.abio.outputs import AbinitOutputFile
+
+    atoms = read(f, format="abinit-out")
+    coordinates = atoms.get_positions()
+
+    about = AbinitOutputFile(f)
+
+    # Read dielectric values
+    die_data = about.datasets[3].split("\n")
+    for j, line in enumerate(die_data):
+        if "Dielectric" in line:
+            die_results_idx = j
+
+    die_values = []
+    for offset in [4, 5, 6, 8, 9, 10, 12, 13, 14]:
+        die_values.append(die_data[die_results_idx + offset].split()[4])
+    dielectric = np.array(die_values, dtype=float).reshape(3, 3)
+
+    # Read polarization values
+    pol_data = about.datasets[4].split("\n")
+    idx_list = []
+    for j, line in enumerate(pol_data):
+        if "Electronic Berry phase" in line:
+            idx_list.append(j)
+
+    # Unfold Berry phase to get continuous distribution
+    pol_values = []
+    for idx in idx_list:
+        p_elec = float(pol_data[idx].split()[3])
+        p_ion = float(pol_data[idx + 1].split()[2])
+        p_ion = 2 + p_ion if p_ion < 0 else p_ion
+        pol_values.append((p_elec + p_ion))
+    polarization_phases = np.array(pol_values)
+    pol_values = np.broadcast_to(np.array(pol_values), (3, 3)).T
+    polarization = (pol_values * au_cell).sum(0) / au_volume
+    return coordinates, dielectric, polarization, polarization_phases
+
+
+def read_files(files, reader, workers=1):
+    r"""
+    Parses the output files with ``reader``, in a pool of
+    processes if ``workers > 1``. The (atoms, data) pairs are
+    yielded in the order of ``files``, so the main process
+    can write them in a single transaction.
+    """
+    if workers > 1:
+        chunksize = max(1, min(64, len(files) // (4 * workers)))
+        with Pool(workers) as pool:
+            yield from pool.imap(reader, files, chunksize=chunksize)
+    else:
+        yield from map(reader, files)
+
+
+def read_bigdft(f):
+    results = read_bigdft_forces(f)
+    atoms = bigdft_forces_to_atoms(results)
+    return atoms, {"energy": results["energy"], "forces": results["forces"]}
+
+
+def read_abinit(f):
+    return read_abinit_output(f)
+
+
+def read_md(f):
+    atoms = read(f, format="extxyz")
+    energy = atoms.get_total_energy()
+    forces = atoms.get_forces()
+    return atoms, {"energy": energy, "forces": forces}
 
 
 if __name__ == "__main__":
@@ -1,39 +1,217 @@
 #! /usr/bin/env python
 
+import os
 import argparse
-import sqlite3
+import hashlib
+import numpy as np
 from ase.db import connect
+from ase.db.sqlite import all_tables
+from utils.database import BulkWriter
+
+
+def content_hash(numbers, cell, positions, decimals=6):
+    r"""
+    Returns a hash of the atomic numbers, cell and positions of a
+    structure, rounded to a number of decimals, so that identical
+    structures written in different databases have the same hash.
+    """
+    numbers = np.asarray(numbers, dtype=np.int32)
+    cell = np.round(np.asarray(cell, dtype=np.float64).reshape(3, 3), decimals)
+    positions = np.round(
+        np.asarray(positions, dtype=np.float64).reshape(-1, 3), decimals
+    )
+    h = hashlib.sha1(numbers.tobytes())
+    # Adding 0.0 turns -0.0 into 0.0
+    h.update((cell + 0.0).tobytes())
+    h.update((positions + 0.0).tobytes())
+    return h.hexdigest()
+
+
+def blob_hash(numbers, cell, positions, decimals=6):
+    r"""
+    content_hash of the blobs of an ASE SQLite database.
+    """
+    return content_hash(
+        np.frombuffer(numbers, dtype=np.int32),
+        np.frombuffer(cell, dtype=np.float64),
+        np.frombuffer(positions, dtype=np.float64),
+        decimals,
+    )
 
 
 class DbMerger:
-    def __init__(self, dbname, old_names):
+    r"""
+    Merges ASE databases in a new or existing database. Structures
+    with the same atomic numbers, cell and rounded positions as a row
+    already merged are skipped, as well as rows with a unique_id that
+    is already present.
+
+    When the target and a source are SQLite databases with the same
+    schema, the source is attached and its rows are copied with
+    INSERT ... SELECT statements, one transaction per source. The
+    other sources are copied row by row.
+
+    The metadata of the target and of the sources are merged in this
+    order, the first value of a key being kept.
+
+    Parameters:
+    ------------
+    dbname : str
+        path to the database to create or complete
+    old_names : list of str
+        paths to the databases to merge
+    decimals : int
+        (default : 6) number of decimals of the positions compared
+    """
+
+    def __init__(self, dbname, old_names, decimals=6):
         self.dbname = str(dbname)
         self.old_names = list(old_names)
+        self.decimals = int(decimals)
 
     def mergedata(self):
-        meta = {}
-        with connect(self.dbname) as db:
+        with BulkWriter(self.dbname, verbose=False) as writer:
+            meta = dict(writer.db.metadata)
+            if writer.is_sqlite:
+                con = writer.db.connection
+                con.create_function(
+                    "content_hash",
+                    3,
+                    lambda n, c, p: blob_hash(n, c, p, self.decimals),
+                    deterministic=True,
+                )
+                con.execute("CREATE TEMP TABLE merged (hash TEXT PRIMARY KEY)")
+                con.execute(
+                    "INSERT OR IGNORE INTO merged "
+                    "SELECT content_hash(numbers, cell, positions) FROM main.systems"
+                )
+            else:
+                self.hashes = set(
+                    content_hash(row.numbers, row.cell, row.positions, self.decimals)
+                    for row in writer.db.select()
+                )
+
             for name in self.old_names:
-                with connect(name) as olddb:
-                    meta.update(**olddb.metadata)
-                    for row in olddb.select():
-                        try:
-                            db.write(row)
-                        except sqlite3.IntegrityError:
-                            pass
+                olddb = connect(name)
+                for key, value in olddb.metadata.items():
+                    if key in meta and meta[key] != value:
+                        print("Metadata {} of {} is ignored.".format(key, name))
+                    meta.setdefault(key, value)
+                if writer.is_sqlite and self._same_schema(con, name):
+                    n_new, n_rows = self._attach_merge(con, name)
+                else:
+                    n_new, n_rows = self._row_merge(writer, olddb)
+                print("Merged {} new rows of {} from {}.".format(n_new, n_rows, name))
+
         db = connect(self.dbname)
         db.metadata = meta
 
+    def _same_schema(self, con, name):
+        if os.path.splitext(name)[1] != ".db":
+            return False
+        con.commit()
+        con.execute("ATTACH DATABASE ? AS src", (name,))
+        try:
+            return all(
+                self._columns(con, "main", table) == self._columns(con, "src", table)
+                for table in all_tables
+            )
+        finally:
+            con.execute("DETACH DATABASE src")
+
+    def _columns(self, con, schema, table):
+        cur = con.execute("PRAGMA {}.table_info({})".format(schema, table))
+        return [row[1] for row in cur]
+
+    def _attach_merge(self, con, name):
+        con.commit()
+        con.execute("ATTACH DATABASE ? AS src", (name,))
+        try:
+            first_id = con.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM main.systems"
+            ).fetchone()[0]
+            con.execute(
+                "CREATE TEMP TABLE src_rows AS SELECT id AS old_id, unique_id, "
+                "content_hash(numbers, cell, positions) AS hash FROM src.systems"
+            )
+            # The first row of each new structure gets the next free id
+            con.execute(
+                "CREATE TEMP TABLE idmap AS SELECT old_id, hash, "
+                "? + ROW_NUMBER() OVER (ORDER BY old_id) AS new_id FROM "
+                "(SELECT MIN(old_id) AS old_id, hash FROM temp.src_rows "
+                "WHERE hash NOT IN (SELECT hash FROM temp.merged) "
+                "AND unique_id NOT IN (SELECT unique_id FROM main.systems) "
+                "GROUP BY hash)",
+                (first_id,),
+            )
+            for table in all_tables:
+                columns = ", ".join(
+                    c for c in self._columns(con, "main", table) if c != "id"
+                )
+                con.execute(
+                    "INSERT INTO main.{0} (id, {1}) SELECT m.new_id, {1} "
+                    "FROM src.{0} JOIN temp.idmap AS m ON src.{0}.id = m.old_id "
+                    "ORDER BY m.new_id".format(table, columns)
+                )
+            con.execute("INSERT INTO temp.merged SELECT hash FROM temp.idmap")
+            n_new = con.execute("SELECT COUNT(*) FROM temp.idmap").fetchone()[0]
+            n_rows = con.execute("SELECT COUNT(*) FROM temp.src_rows").fetchone()[0]
+            con.execute("DROP TABLE temp.src_rows")
+            con.execute("DROP TABLE temp.idmap")
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            con.execute("DETACH DATABASE src")
+        return n_new, n_rows
+
+    def _row_merge(self, writer, olddb):
+        if writer.is_sqlite:
+            con = writer.db.connection
+            unique_ids = set(
+                row[0] for row in con.execute("SELECT unique_id FROM main.systems")
+            )
+        else:
+            unique_ids = set(row.unique_id for row in writer.db.select())
+        n_new, n_rows = 0, 0
+        for row in olddb.select(sort="id"):
+            n_rows += 1
+            h = content_hash(row.numbers, row.cell, row.positions, self.decimals)
+            if self._is_merged(writer, h) or row.unique_id in unique_ids:
+                continue
+            writer.write(row)
+            unique_ids.add(row.unique_id)
+            n_new += 1
+        return n_new, n_rows
+
+    def _is_merged(self, writer, h):
+        if not writer.is_sqlite:
+            if h in self.hashes:
+                return True
+            self.hashes.add(h)
+            return False
+        cur = writer.db.connection.execute(
+            "INSERT OR IGNORE INTO temp.merged VALUES (?)", (h,)
+        )
+        return cur.rowcount == 0
+
 
 def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("dbname", help="Path to the database to create")
     parser.add_argument("old_dbs", help="Paths to the databases to merge", nargs="*")
+    parser.add_argument(
+        "--decimals",
+        type=int,
+        default=6,
+        help="Number of decimals of the positions compared to find duplicates.",
+    )
     return parser
 
 
 if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
-    dbs = DbMerger(dbname=args.dbname, old_names=args.old_dbs)
+    dbs = DbMerger(dbname=args.dbname, old_names=args.old_dbs, decimals=args.decimals)
     dbs.mergedata()
@@ -5,9 +5,17 @@ import sys
 import ase
 import argparse
 from ase.db import connect
-from mybigdft import Posinp, Job, InputParams, Logfile
 from shutil import rmtree, copyfile
 from copy import deepcopy
+from utils.jobs import CLEANUP_MODES, JobDirectory, JobManifest, ResultSink
+from utils.jobs.backends import (
+    BACKENDS,
+    BACKEND_HELP,
+    bigdft_structure,
+    get_bigdft_job,
+    read_input_params,
+    run_bigdft_job,
+)
 
 
 class DbReader:
@@ -15,15 +23,14 @@ class DbReader:
         self.parser = self._create_parser()
         args = self.parser.parse_args()
         self.dbname = args.dbname
-        self.input = InputParams()
-        for filename in [f for f in os.listdir() if f.endswith(".yaml")]:
-            try:
-                self.input = InputParams.from_file(filename)
-                break
-            except:
-                continue
+        self.input = read_input_params(args.backend)
         self.pseudos = args.no_pseudos
         self.nmpi = args.nmpi
+        self.backend = args.backend
+        self.shard = args.shard
+        self.ids = args.ids
+        self.results_db = args.results_db
+        self.cleanup = args.cleanup
 
     def _create_parser(self):
         parser = argparse.ArgumentParser(add_help=False)
@@ -37,6 +44,38 @@ class DbReader:
         parser.add_argument(
             "--nmpi", help="Number of mpi processes", type=int, default=6
         )
+        parser.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            default="dft",
+            help=BACKEND_HELP,
+        )
+        parser.add_argument(
+            "--shard",
+            default=None,
+            help="Only calculate the rows of shard i of N, given as i/N with "
+            "0 <= i < N. Row id belongs to shard id % N, so separate runs "
+            "with different i share the work without coordination.",
+        )
+        parser.add_argument(
+            "--ids",
+            type=int,
+            nargs="+",
+            default=None,
+            help="Only calculate the rows with these ids.",
+        )
+        parser.add_argument(
+            "--results_db",
+            default=None,
+            help="Database where the energy and forces of each job are written "
+            "as soon as it finishes.",
+        )
+        parser.add_argument(
+            "--cleanup",
+            choices=CLEANUP_MODES,
+            default="keep",
+            help="What to do with the directory of a finished job.",
+        )
         return parser
 
     def read(self):
@@ -44,50 +83,96 @@ class DbReader:
         os.makedirs("run_dir/", exist_ok=True)
         os.makedirs("saved_results/", exist_ok=True)
         jobname = self.dbname.split(".")[0]
+        if self.shard is None:
+            manifest = JobManifest()
+        else:
+            # One manifest per shard, so that shards never share a database
+            manifest = JobManifest(
+                os.path.join("run_dir", "manifest_{}of{}.db".format(*self.shard))
+            )
+        done = manifest.completed()
+        sink = ResultSink(self.results_db, cleanup=self.cleanup)
+        output = "forces_{}.xyz".format(jobname)
 
         with connect(self.dbname) as db:
-            os.chdir("run_dir/")
-            for i in range(1, db.count() + 1):
-                at = db.get_atoms(id=i)
-                pos = Posinp.from_ase(at)
-                try:
-                    os.makedirs("{}_{:06}".format(jobname, i))
-                    os.chdir("{}_{:06}".format(jobname, i))
-                    job = Job(
-                        name=jobname,
-                        posinp=pos,
-                        inputparams=self.input,
-                        pseudos=self.pseudos,
+            for row in self.select(db):
+                i = row.id
+                workdir = JobDirectory(
+                    "{}_{:06}".format(jobname, i), "{:06}.xyz".format(i)
+                )
+                if workdir.name in done:
+                    continue
+                pos = bigdft_structure(row.toatoms(), self.backend)
+                track = manifest.track(workdir.name, i, result_path=workdir.result_path)
+                if workdir.create():
+                    with track:
+                        self.run_job(workdir, jobname, pos)
+                        sink.collect(workdir, output, "bigdft", idx=i)
+                elif workdir.bigdft_completed(jobname):
+                    workdir.save(output)
+                    sink.collect(workdir, output, "bigdft", idx=i)
+                    manifest.set_completed(
+                        workdir.name, i, result_path=workdir.result_path
                     )
-                    job.run(nmpi=self.nmpi)
-                    copyfile(
-                        "forces_{}.xyz".format(jobname),
-                        "../../saved_results/{:06}.xyz".format(i),
-                    )
-                    os.chdir("../")
-                except OSError:
-                    os.chdir("{}_{:06}".format(jobname, i))
-                    try:
-                        log = Logfile.from_file("log-" + jobname + ".yaml")
-                        copyfile(
-                            "forces_{}.xyz".format(jobname),
-                            "../../saved_results/{:06}.xyz".format(i),
-                        )
-                        print("Calculation {:06} was complete.\n".format(i))
-                    except:
-                        job = Job(
-                            name=jobname,
-                            posinp=pos,
-                            inputparams=self.input,
-                            pseudos=self.pseudos,
-                        )
-                        job.run(nmpi=self.nmpi, restart_if_incomplete=True)
-                        copyfile(
-                            "forces_{}.xyz".format(jobname),
-                            "../../saved_results/{:06}.xyz".format(i),
-                        )
-                    os.chdir("../")
-            os.chdir("../")
+                    print("Calculation {:06} was complete.\n".format(i))
+                else:
+                    with track:
+                        self.run_job(workdir, jobname, pos, restart=True)
+                        sink.collect(workdir, output, "bigdft", idx=i)
+
+    def select(self, db, window=1000):
+        r"""
+        Yields the rows to calculate, in order of id, without
+        loading the whole database. The ids are selected first, then
+        the rows are read in windows of consecutive ids.
+        """
+        ids = self.select_ids(db)
+        for start in range(0, len(ids), window):
+            wanted = set(ids[start : start + window])
+            selection = "id>={},id<={}".format(
+                ids[start], ids[min(start + window, len(ids)) - 1]
+            )
+            for row in db.select(selection, sort="id", include_data=False):
+                if row.id in wanted:
+                    yield row
+
+    def select_ids(self, db):
+        r"""
+        Returns the sorted ids of the rows to calculate. For SQLite
+        databases, the shard is filtered in the query.
+        """
+        if self.ids is not None:
+            ids = sorted(set(self.ids))
+        elif getattr(db, "connection", None) is not None:
+            if self.shard is None:
+                cur = db.connection.execute("SELECT id FROM systems ORDER BY id")
+            else:
+                cur = db.connection.execute(
+                    "SELECT id FROM systems WHERE id % ? = ? ORDER BY id",
+                    (self.shard[1], self.shard[0]),
+                )
+            return [row[0] for row in cur]
+        else:
+            ids = [row.id for row in db.select(columns=["id"], include_data=False)]
+            ids.sort()
+        if self.shard is None:
+            return ids
+        return [i for i in ids if i % self.shard[1] == self.shard[0]]
+
+    def run_job(self, workdir, jobname, pos, restart=False):
+        Job = get_bigdft_job(self.backend)
+        job = Job(
+            name=jobname,
+            posinp=pos,
+            inputparams=self.input,
+            pseudos=self.pseudos,
+            run_dir=workdir.path,
+        )
+        if restart:
+            run_bigdft_job(job, nmpi=self.nmpi, restart_if_incomplete=True)
+        else:
+            run_bigdft_job(job, nmpi=self.nmpi)
+        workdir.save("forces_{}.xyz".format(jobname))
 
     @property
     def dbname(self):
@@ -101,6 +186,23 @@ class DbReader:
         else:
             self._dbname = dbname + ".db"
 
+    @property
+    def shard(self):
+        return self._shard
+
+    @shard.setter
+    def shard(self, shard):
+        if shard is None or isinstance(shard, tuple):
+            self._shard = shard
+            return
+        try:
+            i, n = [int(x) for x in str(shard).split("/")]
+        except ValueError:
+            raise ValueError("The shard should be given as i/N, not {}.".format(shard))
+        if not 0 <= i < n:
+            raise ValueError("The shard index should be between 0 and N-1.")
+        self._shard = (i, n)
+
     @property
     def parser(self):
         return self._parser
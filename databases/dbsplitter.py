@@ -1,74 +1,528 @@
 #! /usr/bin/env python
 
+import os
 import argparse
 import numpy as np
 from ase.db import connect
+from contextlib import ExitStack
 from copy import deepcopy
+from utils.database import BulkWriter
+
+H5_SPLIT_MODES = ["copy", "virtual", "index"]
+SHARED_DATASETS = ["cell", "atomic_numbers"]
+NPZ_STRATEGIES = ["random", "n_atoms", "source"]
+
+
+def split_sizes(split, n_rows, clamp=False):
+    r"""
+    Returns the number of rows of each output of a split.
+
+    Parameters:
+    ------------
+    split : list
+        sizes of the outputs, either all numbers of rows or all
+        fractions of the rows, summing to at most one. The remaining
+        rows, if any, go to a last output.
+    n_rows : int
+        number of rows to split
+    clamp : bool
+        (default : False) if True, numbers of rows larger than what the
+        previous outputs left are reduced to the remaining rows, instead
+        of raising an error
+    """
+    fractions = [0 < s < 1 for s in split]
+    if any(fractions) and not all(fractions):
+        raise ValueError(
+            "The splits {} mix fractions and numbers of rows.".format(split)
+        )
+    if all(fractions):
+        if sum(split) > 1 and not np.isclose(sum(split), 1):
+            raise ValueError("The fractions {} sum to more than one.".format(split))
+        sizes = [int(np.floor(s * n_rows)) for s in split]
+        # Fractions summing to one cover all the rows
+        if np.isclose(sum(split), 1):
+            sizes[-1] = n_rows - sum(sizes[:-1])
+    else:
+        if any(s < 0 or s != int(s) for s in split):
+            raise ValueError(
+                "The numbers of rows {} should be non-negative integers.".format(split)
+            )
+        sizes = [int(s) for s in split]
+        if clamp:
+            bounds = np.minimum(np.cumsum(sizes), n_rows)
+            sizes = [int(s) for s in np.diff(bounds, prepend=0)]
+    if sum(sizes) > n_rows:
+        raise ValueError(
+            "The splits have {} rows, but there are only {}.".format(sum(sizes), n_rows)
+        )
+    if sum(sizes) < n_rows:
+        sizes.append(n_rows - sum(sizes))
+    return sizes
+
+
+def split_labels(sizes, rng=None, strata=None):
+    r"""
+    Returns the index of the output of each row.
+
+    Parameters:
+    ------------
+    sizes : list of int
+        number of rows of each output, from split_sizes
+    rng : numpy.random.Generator
+        (default : None) generator shuffling the rows, the rows are
+        assigned in order if None
+    strata : array
+        (default : None) if given, the rows with the same value are
+        split separately, in the same proportions as the sizes
+    """
+    sizes = np.asarray(sizes, dtype=int)
+    n_rows = int(sizes.sum())
+    labels = np.empty(n_rows, dtype=int)
+    if strata is None:
+        groups = [np.arange(n_rows)]
+    else:
+        strata = np.asarray(strata)
+        groups = [np.flatnonzero(strata == value) for value in np.unique(strata)]
+        if rng is not None:
+            groups = [groups[i] for i in rng.permutation(len(groups))]
+    # The rounding of each stratum is carried to the next ones, so
+    # that the outputs get exactly their sizes
+    carry = np.zeros(len(sizes))
+    for rows in groups:
+        quotas = sizes * len(rows) / n_rows + carry
+        counts = stratum_counts(quotas, len(rows))
+        carry = quotas - counts
+        if rng is not None:
+            rows = rng.permutation(rows)
+        labels[rows] = np.repeat(np.arange(len(sizes)), counts)
+    if not np.array_equal(np.bincount(labels, minlength=len(sizes)), sizes):
+        raise ValueError("The rows could not be split in the sizes {}.".format(sizes))
+    return labels
+
+
+def stratum_counts(quotas, n_rows):
+    r"""
+    Returns the number of rows of a stratum going to each output, from
+    the quotas of the outputs, by the largest remainder method.
+    """
+    counts = np.maximum(np.floor(quotas), 0).astype(int)
+    # Outputs with the largest remainders get the missing rows, and
+    # outputs with the smallest ones give back the extra rows
+    for i in np.argsort(counts - quotas, kind="stable"):
+        if counts.sum() >= n_rows:
+            break
+        counts[i] += 1
+    for i in np.argsort(quotas - counts, kind="stable"):
+        if counts.sum() <= n_rows:
+            break
+        if counts[i] > 0:
+            counts[i] -= 1
+    return counts
+
+
+def output_names(path, names, n_outputs, extension):
+    base = os.path.splitext(path)[0]
+    if names is None:
+        names = [str(i + 1) for i in range(n_outputs)]
+    if len(names) != n_outputs:
+        raise ValueError(
+            "There are {} outputs, but {} names were given.".format(
+                n_outputs, len(names)
+            )
+        )
+    return ["{}_{}{}".format(base, name, extension) for name in names]
 
 
 class DbSplitter:
-    def __init__(self, dbname, split):
+    r"""
+    Splits an ASE database in several databases, for example train,
+    validation and test sets. The rows are assigned to the outputs by
+    a seeded permutation of their ids, then the source is read once,
+    in the order of the ids, and each row is written to its output
+    with batched transactions. The rows keep their order in the
+    outputs.
+
+    Parameters:
+    ------------
+    dbname : str
+        path to the database to split
+    split : int, float or list
+        sizes of the outputs, as numbers of rows or fractions of the
+        database. The remaining rows, if any, go to a last output.
+    names : list of str
+        (default : None) suffixes of the outputs, 1, 2, ... if None
+    seed : int
+        (default : None) seed of the permutation, random if None
+    """
+
+    def __init__(self, dbname, split, names=None, seed=None):
         self.dbname = str(dbname)
-        self.split = int(split)
+        self.split = np.atleast_1d(split).tolist()
+        self.names = names
+        self.seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+
+    def assignments(self, n_rows):
+        r"""
+        Returns the index of the output of each row, in the order of
+        the ids, and the names of the outputs.
+        """
+        sizes = split_sizes(self.split, n_rows)
+        labels = split_labels(sizes, np.random.default_rng(self.seed))
+        return labels, output_names(self.dbname, self.names, len(sizes), ".db")
 
     def splitdata(self):
-        out1, out2 = (
-            self.dbname.strip(".db") + "_1.db",
-            self.dbname.strip(".db") + "_2.db",
-        )
-        with connect(self.dbname) as db, connect(out1) as db1, connect(out2) as db2:
+        print("Random seed: {}".format(self.seed))
+        with connect(self.dbname) as db:
             meta = deepcopy(db.metadata)
-            db1.metadata = meta
-            db2.metadata = meta
-            idx = np.arange(1, db.count() + 1)
-            np.random.shuffle(idx)
-            idx1, idx2 = idx[: self.split], idx[self.split :]
-            for idx in idx1:
-                row = db.get(id=idx.item())
-                db1.write(row)
-            for idx in idx2:
-                row = db.get(id=idx.item())
-                db2.write(row)
+            labels, outputs = self.assignments(db.count())
+            with ExitStack() as stack:
+                writers = [
+                    stack.enter_context(BulkWriter(out, metadata=meta, append=False))
+                    for out in outputs
+                ]
+                for label, row in zip(labels, db.select(sort="id")):
+                    writers[label].write(row)
+        return outputs
 
 
 class H5Splitter:
-    def __init__(self, dbname, split):
+    r"""
+    Splits every group of a radnet HDF5 file in several parts. The
+    datasets shared by the structures of a group, cell and
+    atomic_numbers, are kept whole, and the other datasets are split
+    along their first axis. The rows keep their order in the outputs.
+
+    The outputs can be written in three modes. copy writes new files
+    with the selected rows, read in chunks. virtual writes new files
+    whose split datasets are HDF5 virtual datasets pointing into the
+    original file, which must stay next to them. index only writes
+    the selected row indices of every group and output to a
+    {name}_split.npz file, with keys {group}/{output}.
+
+    Parameters:
+    ------------
+    dbname : str
+        path to the file to split
+    split : int, float or list
+        sizes of the outputs in each group, as numbers of rows or
+        fractions of the group. The remaining rows, if any, go to a
+        last output. The numbers of rows are taken in order in each
+        group, so the last outputs of the groups with too few rows
+        are smaller or empty.
+    names : list of str
+        (default : None) suffixes of the outputs, 1, 2, ... if None
+    seed : int
+        (default : None) seed of the permutations, random if None
+    mode : str
+        (default : copy) copy, virtual or index
+    shuffle : bool
+        (default : True) if False, the outputs take consecutive rows
+    stratify : str
+        (default : None) name of a dataset of the groups, the rows with
+        the same value are split in the same proportions
+    chunk_size : int
+        (default : 10000) number of rows copied at once
+    """
+
+    def __init__(
+        self,
+        dbname,
+        split,
+        names=None,
+        seed=None,
+        mode="copy",
+        shuffle=True,
+        stratify=None,
+        chunk_size=10000,
+    ):
         self.dbname = str(dbname)
-        self.split = int(split)
+        self.split = np.atleast_1d(split).tolist()
+        self.names = names
+        self.seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+        if mode not in H5_SPLIT_MODES:
+            raise ValueError(
+                "The mode should be one of {}, not {}.".format(H5_SPLIT_MODES, mode)
+            )
+        self.mode = mode
+        self.shuffle = shuffle
+        self.stratify = stratify
+        self.chunk_size = int(chunk_size)
+
+    def selections(self, h5file):
+        r"""
+        Returns the sorted indices of the rows of each output, for each
+        group, and the number of outputs.
+        """
+        rng = np.random.default_rng(self.seed) if self.shuffle else None
+        selections, n_outputs = {}, 0
+        for structname, structval in h5file.items():
+            n_rows = len(structval["coordinates"])
+            sizes = split_sizes(self.split, n_rows, clamp=True)
+            strata = None if self.stratify is None else structval[self.stratify][:]
+            labels = split_labels(sizes, rng, strata)
+            selections[structname] = [
+                np.flatnonzero(labels == i) for i in range(len(sizes))
+            ]
+            n_outputs = max(n_outputs, len(sizes))
+        # Groups whose rows fill fewer outputs get empty selections
+        for indices in selections.values():
+            indices += [np.array([], dtype=int)] * (n_outputs - len(indices))
+        return selections, n_outputs
 
     def splitdata(self):
         import h5py
 
-        out1 = self.dbname.strip(".h5") + "_1.h5"
-        out2 = self.dbname.strip(".h5") + "_2.h5"
+        if self.shuffle:
+            print("Random seed: {}".format(self.seed))
+        with h5py.File(self.dbname, "r") as old:
+            selections, n_outputs = self.selections(old)
+            if self.mode == "index":
+                output = os.path.splitext(self.dbname)[0] + "_split.npz"
+                names = self.names or [str(i + 1) for i in range(n_outputs)]
+                np.savez(
+                    output,
+                    **{
+                        "{}/{}".format(structname, name): idx
+                        for structname, indices in selections.items()
+                        for name, idx in zip(names, indices)
+                    }
+                )
+                return [output]
+
+            outputs = output_names(self.dbname, self.names, n_outputs, ".h5")
+            for i, out in enumerate(outputs):
+                with h5py.File(out, "w") as new:
+                    for structname, structval in old.items():
+                        group = new.create_group(structname)
+                        for prop, dataset in structval.items():
+                            if prop in SHARED_DATASETS:
+                                group.create_dataset(prop, data=dataset[()])
+                            else:
+                                self._write_rows(
+                                    group, prop, dataset, selections[structname][i]
+                                )
+        return outputs
+
+    def _write_rows(self, group, prop, dataset, indices):
+        import h5py
+
+        # Variable length strings can not be virtual datasets
+        if self.mode == "virtual" and h5py.check_string_dtype(dataset.dtype) is None:
+            layout = h5py.VirtualLayout(
+                shape=(len(indices),) + dataset.shape[1:], dtype=dataset.dtype
+            )
+            source = h5py.VirtualSource(
+                os.path.basename(self.dbname), dataset.name, shape=dataset.shape
+            )
+            # Each run of consecutive rows is mapped at once
+            breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+            for run in np.split(np.arange(len(indices)), breaks):
+                if len(run) > 0:
+                    start, end = indices[run[0]], indices[run[-1]] + 1
+                    layout[run[0] : run[-1] + 1] = source[start:end]
+            group.create_virtual_dataset(prop, layout)
+            return
+
+        new = group.create_dataset(
+            prop,
+            shape=(len(indices),) + dataset.shape[1:],
+            dtype=dataset.dtype,
+            compression=dataset.compression,
+        )
+        for start in range(0, len(indices), self.chunk_size):
+            rows = indices[start : start + self.chunk_size]
+            new[start : start + len(rows)] = dataset[rows]
+
+
+class NpzSplitter:
+    r"""
+    Writes the train, validation and test indices of an ASE database
+    to a split.npz file read by schnetpack, instead of copying the rows.
+    The index of a row is its id minus one, since schnetpack.AtomsData
+    reads index i from the row with id i + 1, so the indices stay valid
+    if some ids are missing.
+
+    Parameters:
+    ------------
+    dbname : str
+        path to the database to split
+    split : int, float or list
+        sizes of the train and validation sets, and optionally of the
+        test set, as numbers of rows or fractions of the database. The
+        remaining rows, if any, go to the test set.
+    seed : int
+        (default : None) seed of the permutation, random if None
+    strategy : str
+        (default : random) random, n_atoms to split every number of
+        atoms in the same proportions, or source to keep all the rows
+        with the same value of key in the same set, as the source key
+        written by dbcreator.py --source
+    key : str
+        (default : source) key of the rows used by the source strategy
+    output : str
+        (default : split.npz) path of the split file
+    """
 
-        with h5py.File(self.dbname, "r") as old, h5py.File(
-            out1, "w"
-        ) as new1, h5py.File(out2, "w") as new2:
-            for structname, structval in old.items():
-                group1 = new1.create_group(structname)
-                group2 = new2.create_group(structname)
+    def __init__(
+        self,
+        dbname,
+        split,
+        seed=None,
+        strategy="random",
+        key="source",
+        output="split.npz",
+    ):
+        self.dbname = str(dbname)
+        self.split = np.atleast_1d(split).tolist()
+        self.seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+        if strategy not in NPZ_STRATEGIES:
+            raise ValueError(
+                "The strategy should be one of {}, not {}.".format(
+                    NPZ_STRATEGIES, strategy
+                )
+            )
+        self.strategy = strategy
+        self.key = key
+        self.output = output
+
+    def read_rows(self):
+        r"""
+        Returns the id, the number of atoms and the key of every row, in
+        the order of the ids, without reading the data of the rows.
+        """
+        ids, natoms, keys = [], [], []
+        with connect(self.dbname) as db:
+            for row in db.select(
+                sort="id",
+                include_data=False,
+                columns=["id", "numbers", "key_value_pairs"],
+            ):
+                ids.append(row.id)
+                natoms.append(row.natoms)
+                keys.append(row.get(self.key))
+        return np.array(ids, dtype=int), np.array(natoms), keys
 
-                for i, group in enumerate([group1, group2]):
-                    for prop in ["cell", "atomic_numbers"]:
-                        group.create_dataset(prop, data=structval[prop])
+    def labels(self, natoms, keys):
+        r"""
+        Returns the set of each row, 0 for train, 1 for validation
+        and 2 for test.
+        """
+        sizes = split_sizes(self.split, len(natoms))
+        if len(sizes) > 3:
+            raise ValueError("There can only be train, validation and test sets.")
+        sizes += [0] * (3 - len(sizes))
+        rng = np.random.default_rng(self.seed)
 
-                    for prop in ["coordinates", "dielectric", "polarization", "target"]:
-                        if i == 0:
-                            group.create_dataset(
-                                prop, data=structval[prop][: self.split]
-                            )
-                        elif i == 1:
-                            group.create_dataset(
-                                prop, data=structval[prop][self.split :]
-                            )
+        if self.strategy == "random":
+            return split_labels(sizes, rng)
+        elif self.strategy == "n_atoms":
+            return split_labels(sizes, rng, strata=natoms)
+
+        if any(k is None for k in keys):
+            raise KeyError("Some rows have no {} key.".format(self.key))
+        # Whole sources, in random order, fill the sets one after the other
+        sources, inverse, counts = np.unique(
+            np.array(keys, dtype=str), return_inverse=True, return_counts=True
+        )
+        order = rng.permutation(len(sources))
+        filled = np.cumsum(counts[order]) - counts[order] / 2
+        source_labels = np.empty(len(sources), dtype=int)
+        source_labels[order] = np.searchsorted(np.cumsum(sizes), filled, side="right")
+        return source_labels[inverse.reshape(-1)]
+
+    def splitdata(self):
+        print("Random seed: {}".format(self.seed))
+        ids, natoms, keys = self.read_rows()
+        labels = self.labels(natoms, keys)
+        indices = [ids[labels == i] - 1 for i in range(3)]
+        # The sets given by the split, or getting the remaining rows
+        requested = len(split_sizes(self.split, len(ids)))
+        for name, idx in zip(["train", "validation", "test"][:requested], indices):
+            if len(idx) == 0:
+                raise ValueError(
+                    "The {} set is empty with the {} strategy.".format(
+                        name, self.strategy
+                    )
+                )
+        os.makedirs(os.path.dirname(os.path.abspath(self.output)), exist_ok=True)
+        np.savez(
+            self.output, train_idx=indices[0], val_idx=indices[1], test_idx=indices[2]
+        )
+        print(
+            "Wrote {} train, {} validation and {} test indices to {}.".format(
+                *[len(idx) for idx in indices], self.output
+            )
+        )
+        return [self.output]
 
 
 def create_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument("mode", choices=["db", "h5"], help="Dataset mode")
+    parser.add_argument(
+        "mode",
+        choices=["db", "h5", "npz"],
+        help="Dataset mode. npz only writes a schnetpack split.npz file with the "
+        "train, validation and test indices of an ASE database.",
+    )
     parser.add_argument("dbname", help="Path to the database to split")
-    parser.add_argument("split", help="Size of the database to extract", type=int)
+    parser.add_argument(
+        "split",
+        nargs="+",
+        type=float,
+        help="Sizes of the databases to extract, as numbers of rows or fractions "
+        "of the database. The remaining rows are written to a last database. "
+        "For h5, the numbers of rows apply to each group, and the groups with "
+        "fewer rows fill the outputs in order.",
+    )
+    parser.add_argument(
+        "--names",
+        nargs="+",
+        default=None,
+        help="Suffixes of the output databases, for example train val test.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random permutation of the rows.",
+    )
+    parser.add_argument(
+        "--h5_mode",
+        choices=H5_SPLIT_MODES,
+        default="copy",
+        help="Only for h5. Copy the rows, write virtual datasets pointing into "
+        "the original file, or only write the indices of the rows.",
+    )
+    parser.add_argument(
+        "--no_shuffle",
+        default=False,
+        action="store_true",
+        help="Only for h5. The outputs take consecutive rows of each group.",
+    )
+    parser.add_argument(
+        "--stratify",
+        default=None,
+        help="Only for h5. Dataset of the groups whose values are split in the "
+        "same proportions, for example multiplicity.",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=NPZ_STRATEGIES,
+        default="random",
+        help="Only for npz. Shuffle the rows, split every number of atoms in the "
+        "same proportions, or keep the rows of a source file in the same set.",
+    )
+    parser.add_argument(
+        "--key",
+        default="source",
+        help="Only for npz. Key of the rows grouped by the source strategy, "
+        "written by dbcreator.py --source.",
+    )
+    parser.add_argument(
+        "--output",
+        default="split.npz",
+        help="Only for npz. Path of the split file, usually in the model folder.",
+    )
     return parser
 
 
@@ -76,10 +530,30 @@ if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
     if args.mode == "db":
-        dbs = DbSplitter(dbname=args.dbname, split=args.split)
+        dbs = DbSplitter(
+            dbname=args.dbname, split=args.split, names=args.names, seed=args.seed
+        )
         dbs.splitdata()
     elif args.mode == "h5":
-        h5s = H5Splitter(dbname=args.dbname, split=args.split)
+        h5s = H5Splitter(
+            dbname=args.dbname,
+            split=args.split,
+            names=args.names,
+            seed=args.seed,
+            mode=args.h5_mode,
+            shuffle=not args.no_shuffle,
+            stratify=args.stratify,
+        )
         h5s.splitdata()
+    elif args.mode == "npz":
+        nps = NpzSplitter(
+            dbname=args.dbname,
+            split=args.split,
+            seed=args.seed,
+            strategy=args.strategy,
+            key=args.key,
+            output=args.output,
+        )
+        nps.splitdata()
     else:
         raise ValueError("Mode is not specified.")
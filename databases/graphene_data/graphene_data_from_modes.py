@@ -1,15 +1,13 @@
 #! /usr/bin/env python
 
-from abipy.abio.outputs import AbinitOutputFile
 from ase.io import read
-from ase.calculators.abinit import Abinit
-from shutil import rmtree, copyfile
-from copy import deepcopy
 import yaml
 import numpy as np
 import argparse
 import pickle
 import os
+from utils.jobs import CLEANUP_MODES, JobDirectory, JobManifest, ResultSink
+from utils.jobs.backends import BACKENDS, BACKEND_HELP, get_abinit_calculator
 
 
 def create_parser():
@@ -27,7 +25,39 @@ def create_parser():
     )
     parser.add_argument("input", help="Name of the yaml input file.")
     parser.add_argument(
-        "modes", help="Name of the pickle file containing the normal modes."
+        "modes",
+        help="Name of the file containing the normal modes, a .npy file or "
+        "a pickle file, which is converted to .npy once.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the mode amplitudes, random if not given.",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Write every displaced structure to <jobname>_structures.npy "
+        "before running the calculations.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="dft",
+        help=BACKEND_HELP,
+    )
+    parser.add_argument(
+        "--results_db",
+        default=None,
+        help="Database where the energy and forces of each job are written "
+        "as soon as it finishes.",
+    )
+    parser.add_argument(
+        "--cleanup",
+        choices=CLEANUP_MODES,
+        default="keep",
+        help="What to do with the directory of a finished job.",
     )
     return parser
 
@@ -36,64 +66,110 @@ def main(args):
     # Create directories
     os.makedirs("run_dir/", exist_ok=True)
     os.makedirs("saved_results/", exist_ok=True)
+    manifest = JobManifest()
+    done = manifest.completed()
+    sink = ResultSink(args.results_db, cleanup=args.cleanup)
 
-    with open(args.modes, "rb") as f:
-        modes = pickle.load(f)
-    modes = modes[0]
+    modes = load_modes(args.modes)
 
     jobname = args.positions.split(".")[0]
     initatoms = read(args.positions, format="abinit-in")
     with open(args.input, "r") as f:
         inputs = yaml.load(f, Loader=yaml.BaseLoader)
-    calculator = Abinit(**inputs)
+    calculator = get_abinit_calculator(args.backend)
+
+    seed = np.random.SeedSequence().entropy if args.seed is None else args.seed
+    print("Random seed: {}".format(seed))
+    amplitudes = 2 * np.random.default_rng(seed).random(
+        (args.n_data_per_mode, len(modes))
+    )
+    if args.bulk:
+        structures = write_structures(
+            "{}_structures.npy".format(jobname), initatoms, modes, amplitudes
+        )
 
-    os.chdir("run_dir/")
     for i in range(args.n_data_per_mode):
-        for j, mode in enumerate(modes):
-            try:
-                os.makedirs("{}_{:03}_mode{:04}".format(jobname, i, j))
-                os.chdir("{}_{:03}_mode{:04}".format(jobname, i, j))
-                abinit_run(i, j, mode, calculator, initatoms)
-            except FileExistsError:
-                os.chdir("{}_{:03}_mode{:04}".format(jobname, i, j))
-                try:
-                    about = AbinitOutputFile("abinit.out")
-                    if about.run_completed:
-                        print(
-                            "Calculation {:03} for mode {:04} was complete.\n".format(
-                                i, j
-                            )
-                        )
-                        os.chdir("../")
-                    else:
-                        restart(i, j, mode, calculator, initatoms)
-                except:
-                    restart(i, j, mode, calculator, initatoms)
-
-
-def restart(i, j, mode, calculator, initatoms):
-    for f in os.listdir():
-        os.remove(f)
-    abinit_run(i, j, mode, calculator, initatoms)
-
-
-def abinit_run(i, j, mode, calculator, initatoms):
-    at = abinit_structure(initatoms, mode)
-    at.set_calculator(calculator)
+        for j in range(len(modes)):
+            workdir = JobDirectory(
+                "{}_{:03}_mode{:04}".format(jobname, i, j),
+                "{:03}_mode{:04}.out".format(i, j),
+            )
+            if workdir.name in done:
+                continue
+            idx = i * len(modes) + j
+            if args.bulk:
+                positions = structures[i, j]
+            else:
+                positions = initatoms.positions + amplitudes[i, j] * modes[j]
+            track = manifest.track(workdir.name, idx, result_path=workdir.result_path)
+            if workdir.create():
+                with track:
+                    abinit_run(i, j, positions, workdir, inputs, initatoms, calculator)
+                    sink.collect(workdir, "abinit.out", "abinit", idx=idx, mode=j)
+            elif workdir.abinit_completed():
+                sink.collect(workdir, "abinit.out", "abinit", idx=idx, mode=j)
+                manifest.set_completed(
+                    workdir.name, idx, result_path=workdir.result_path
+                )
+                print("Calculation {:03} for mode {:04} was complete.\n".format(i, j))
+            else:
+                with track:
+                    restart(i, j, positions, workdir, inputs, initatoms, calculator)
+                    sink.collect(workdir, "abinit.out", "abinit", idx=idx, mode=j)
+
+
+def load_modes(filename):
+    r"""
+    Returns the real part of the normal modes as a memory-mapped
+    (n_modes, n_atoms, 3) array. A pickle file is converted
+    to a .npy file next to it the first time it is read.
+    """
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode="r")
+    npy_file = os.path.splitext(filename)[0] + ".npy"
+    if not os.path.exists(npy_file):
+        with open(filename, "rb") as f:
+            modes = pickle.load(f)
+        np.save(npy_file, np.real(np.asarray(modes[0])))
+        print("Normal modes saved to {}.".format(npy_file))
+    return np.load(npy_file, mmap_mode="r")
+
+
+def write_structures(filename, initatoms, modes, amplitudes):
+    r"""
+    Writes the positions of every displaced structure to a
+    (n_data_per_mode, n_modes, n_atoms, 3) .npy file in a single
+    pass, and returns it memory-mapped.
+    """
+    structures = np.lib.format.open_memmap(
+        filename,
+        mode="w+",
+        dtype=np.float64,
+        shape=amplitudes.shape + initatoms.positions.shape,
+    )
+    for i, amplitude in enumerate(amplitudes):
+        structures[i] = initatoms.positions + amplitude[:, None, None] * modes
+    structures.flush()
+    del structures
+    return np.load(filename, mmap_mode="r")
+
+
+def restart(i, j, positions, workdir, inputs, initatoms, calculator):
+    workdir.clear()
+    abinit_run(i, j, positions, workdir, inputs, initatoms, calculator)
+
+
+def abinit_run(i, j, positions, workdir, inputs, initatoms, calculator):
+    at = initatoms.copy()
+    at.set_positions(positions)
+    at.set_calculator(calculator(label=workdir.file("abinit"), **inputs))
     at.get_forces()
-    os.rename("abinit.txt", "abinit.out")
-    copyfile("abinit.out", "../../saved_results/{:03}_mode{:04}.out".format(i, j))
-    for f in os.listdir():
+    os.rename(workdir.file("abinit.txt"), workdir.file("abinit.out"))
+    workdir.save("abinit.out")
+    for f in os.listdir(workdir.path):
         if f.startswith("abinito_"):
-            os.remove(f)
+            os.remove(workdir.file(f))
     print("Calculation {:03} for mode {:04} completed.\n".format(i, j))
-    os.chdir("../")
-
-
-def abinit_structure(initatoms, mode):
-    at = deepcopy(initatoms)
-    at.set_positions(at.positions + np.real(mode) * 2 * np.random.rand())
-    return at
 
 
 if __name__ == "__main__":
@@ -1,149 +1,120 @@
 #! /usr/bin/env python
 
-from mybigdft import Posinp, InputParams, Job, Logfile, Atom
 from shutil import rmtree, copyfile
-from copy import deepcopy
 import numpy as np
 import argparse
 import sys
 import os
-from utils.calculations.graphene import generate_graphene_cell
+from utils.datagen import DefectSampler, RandomDisplacements, displaced_posinp
+from utils.jobs import CLEANUP_MODES, JobDirectory, JobManifest, ResultSink
+from utils.jobs.backends import (
+    BACKENDS,
+    BACKEND_HELP,
+    get_bigdft_job,
+    read_input_params,
+    run_bigdft_job,
+)
+from utils.calculations.graphene import generate_graphene_cell, graphene_cell_arrays
 
 
 def main(args):
 
     initpos = generate_graphene_cell(args.xsize, args.zsize)
-    param = InputParams()
-    for filename in [f for f in os.listdir() if f.endswith(".yaml")]:
-        try:
-            param = InputParams.from_file(filename)
-            break
-        except:
-            continue
+    param = read_input_params(args.backend)
     pseudos = not (args.no_pseudos)
 
     # Create directories
     os.makedirs("run_dir/", exist_ok=True)
     os.makedirs("saved_results/", exist_ok=True)
+    manifest = JobManifest()
+    sink = ResultSink(args.results_db, cleanup=args.cleanup)
 
-    os.chdir("run_dir/")
+    sampler = DefectSampler(
+        *graphene_cell_arrays(args.xsize, args.zsize), seed=args.seed
+    )
+    print("Random seed: {}".format(sampler.seed))
 
     if args.n_defects == 0:
 
+        displacements = RandomDisplacements(
+            len(initpos), seed=sampler.seed, distribution="ball"
+        )
         for i in range(1, args.n_structs + 1):
-            posinp = generate_random_structure(initpos)
-            run(posinp, i, args, param, pseudos)
+            posinp = displaced_posinp(initpos, displacements[i])
+            run(posinp, i, args, param, pseudos, manifest, sink, displacements.seed)
 
     elif args.n_defects == 1:
 
-        initpos, _ = place_first_nitrogen(initpos)
+        initpos = generate_graphene_cell(
+            args.xsize, args.zsize, dopants=[sampler.center]
+        )
 
+        displacements = RandomDisplacements(
+            len(initpos), seed=sampler.seed, distribution="ball"
+        )
         for i in range(1, args.n_structs + 1):
-            posinp = generate_random_structure(initpos)
-            run(posinp, i, args, param, pseudos)
+            posinp = displaced_posinp(initpos, displacements[i])
+            run(posinp, i, args, param, pseudos, manifest, sink, displacements.seed)
 
-    elif args.n_defects == 2:
+    elif args.n_defects > 1:
 
-        initpos, first_idx = place_first_nitrogen(initpos)
-
-        root = np.sqrt(args.n_structs)
-        if root % 1 == 0:
-            n_angle, n_radius = root, root
-        else:
-            n_angle, n_radius = np.ceil(root), np.floor(root)
-        max_radius = np.max(np.array(initpos.cell) / 2)
-        radiuses = np.linspace(1.0, max_radius, n_radius)
-        angles = np.linspace(0, 2 * np.pi, n_angle)
-
-        i = 0
-        # distances = np.zeros(int(n_angle * n_radius))
-        for theta in angles:
-            for r in radiuses:
-                i += 1
-                posinp, second_idx = place_second_nitrogen(initpos, theta, r, first_idx)
-                #        distances[i-1] = np.linalg.norm(posinp.positions[first_idx] - posinp.positions[second_idx])
-                run(posinp, i, args, param, pseudos)
-        # np.savetxt("distances.data", distances)
-
-    elif args.n_defects == 3:
-        root = np.sqrt(args.n_structs)
-        if root % 1 == 0:
-            n_angle, n_radius = root, root
+        if args.n_defects == 2:
+            angles, radiuses = sampler.grid_placements(args.n_structs)
         else:
-            n_angle, n_radius = np.ceil(root), np.floor(root)
+            angles, radiuses = sampler.random_placements(
+                args.n_structs, args.n_defects - 1
+            )
+        configurations = sampler.sample(angles, radiuses)
+        np.savez(
+            "{}_configurations.npz".format(args.name),
+            sites=configurations,
+            distances=sampler.pair_distances(configurations),
+        )
+
+        for i, sites in enumerate(configurations, start=1):
+            posinp = generate_graphene_cell(args.xsize, args.zsize, dopants=sites)
+            run(posinp, i, args, param, pseudos, manifest, sink, sampler.seed)
 
     else:
         raise NotImplementedError("No method for this number of defects.")
 
 
-def run(posinp, i, args, param, pseudos):
-    try:
-        os.makedirs("{}_{:06}".format(args.name, i))
-        os.chdir("{}_{:06}".format(args.name, i))
-        job = Job(name=args.name, posinp=posinp, inputparams=param, pseudos=pseudos)
-        job.run(nmpi=args.nmpi)
-        copyfile(
-            "forces_{}.xyz".format(args.name),
-            "../../saved_results/{:06}.xyz".format(i),
+def run(posinp, i, args, param, pseudos, manifest, sink, seed=None):
+    Job = get_bigdft_job(args.backend)
+    workdir = JobDirectory("{}_{:06}".format(args.name, i), "{:06}.xyz".format(i))
+    track = manifest.track(workdir.name, i, seed, workdir.result_path)
+    output = "forces_{}.xyz".format(args.name)
+    if manifest.is_completed(workdir.name):
+        print("Calculation {:06} was complete.\n".format(i))
+    elif workdir.create():
+        job = Job(
+            name=args.name,
+            posinp=posinp,
+            inputparams=param,
+            pseudos=pseudos,
+            run_dir=workdir.path,
         )
-        os.chdir("../")
-    except OSError:
-        os.chdir("{}_{:06}".format(args.name, i))
-        try:
-            log = Logfile.from_file("log-" + args.name + ".yaml")
-            print("Calculation {:06} was complete.\n".format(i))
-        except:
-            job = Job(name=args.name, posinp=posinp, inputparams=param, pseudos=pseudos)
-            job.run(args.nmpi, restart_if_incomplete=True)
-            copyfile(
-                "forces_{}.xyz".format(args.name),
-                "../../saved_results/{:06}.xyz".format(i),
-            )
-        os.chdir("../")
-
-
-def generate_random_structure(initpos):
-    radius = 0.1
-    pos = deepcopy(initpos)
-    atoms_idx = np.arange(len(pos))
-    n_translations = np.random.randint(len(pos)) + 1
-    trans_idx = np.random.choice(atoms_idx, n_translations)
-    for j in trans_idx:
-        phi = 2 * np.pi * np.random.rand()
-        theta = np.arccos(2 * np.random.rand() - 1)
-        r = radius * np.cbrt(np.random.rand())
-        pos = pos.translate_atom(
-            j,
-            [
-                r * np.sin(theta) * np.cos(phi),
-                r * np.sin(theta) * np.sin(phi),
-                r * np.cos(theta),
-            ],
+        with track:
+            run_bigdft_job(job, nmpi=args.nmpi)
+            workdir.save(output)
+            sink.collect(workdir, output, "bigdft", idx=i)
+    elif workdir.bigdft_completed(args.name):
+        # Jobs completed before the manifest existed
+        sink.collect(workdir, output, "bigdft", idx=i)
+        manifest.set_completed(workdir.name, i, seed, workdir.result_path)
+        print("Calculation {:06} was complete.\n".format(i))
+    else:
+        job = Job(
+            name=args.name,
+            posinp=posinp,
+            inputparams=param,
+            pseudos=pseudos,
+            run_dir=workdir.path,
         )
-    return pos
-
-
-def place_first_nitrogen(posinp):
-    distances_to_middle = np.linalg.norm(
-        posinp.positions - np.array(posinp.cell) / 2, axis=1
-    )
-    idx = np.argmin(distances_to_middle)
-    posinp.atoms[idx] = Atom("N", posinp.atoms[idx].position)
-    return posinp, idx
-
-
-def place_second_nitrogen(initpos, theta, r, first_idx):
-    posinp = deepcopy(initpos)
-    point = np.array(posinp.cell) / 2 + np.array(
-        [r * np.cos(theta), 0, r * np.sin(theta)]
-    )
-    distances_to_point = np.linalg.norm(posinp.positions - point, axis=1)
-    weigths = np.exp(-(distances_to_point ** 2) / 2)
-    weigths[first_idx] = 0
-    weigths = weigths / np.sum(weigths)
-    second_idx = int(np.random.choice(len(posinp), 1, p=weigths))
-    posinp.atoms[second_idx] = Atom("N", posinp.atoms[second_idx].position)
-    return posinp, second_idx
+        with track:
+            run_bigdft_job(job, nmpi=args.nmpi, restart_if_incomplete=True)
+            workdir.save(output)
+            sink.collect(workdir, output, "bigdft", idx=i)
 
 
 def create_parser():
@@ -176,6 +147,31 @@ def create_parser():
         action="store_true",
     )
     parser.add_argument("--nmpi", help="Number of mpi processes", type=int, default=6)
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random displacements and defect sites, "
+        "random if not given.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="dft",
+        help=BACKEND_HELP,
+    )
+    parser.add_argument(
+        "--results_db",
+        default=None,
+        help="Database where the energy and forces of each job are written "
+        "as soon as it finishes.",
+    )
+    parser.add_argument(
+        "--cleanup",
+        choices=CLEANUP_MODES,
+        default="keep",
+        help="What to do with the directory of a finished job.",
+    )
     return parser
 
 
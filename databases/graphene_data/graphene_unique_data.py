@@ -1,87 +1,87 @@
 #! /usr/bin/env python
 
-from mybigdft import Posinp, InputParams, Job, Logfile
 from shutil import rmtree, copyfile
 from copy import deepcopy
 import numpy as np
 import argparse
 import os
+from utils.datagen import RandomDisplacements, displaced_posinp
+from utils.jobs import CLEANUP_MODES, JobDirectory, JobManifest, ResultSink
+from utils.jobs.backends import (
+    BACKENDS,
+    BACKEND_HELP,
+    get_bigdft_job,
+    read_input_params,
+    run_bigdft_job,
+)
 
 
 def main(args):
+    from mybigdft import Posinp
 
-    param = InputParams()
-    for filename in [f for f in os.listdir() if f.endswith(".yaml")]:
-        try:
-            param = InputParams.from_file(filename)
-            break
-        except:
-            continue
+    param = read_input_params(args.backend)
     pseudos = not (args.no_pseudos)
 
     positions = [
         Posinp.from_file(args.positions_dir + file)
-        for file in os.listdir(args.positions_dir)
+        for file in sorted(os.listdir(args.positions_dir))
         if file.endswith(".xyz")
     ]
 
     # Create directories
     os.makedirs("run_dir/", exist_ok=True)
     os.makedirs("saved_results/", exist_ok=True)
+    manifest = JobManifest()
+    sink = ResultSink(args.results_db, cleanup=args.cleanup)
 
-    os.chdir("run_dir/")
-
-    for i in range(args.n_structs):
-        j = int(np.random.choice(len(positions), 1))
-        posinp = generate_random_structure(positions[j])
-        run(posinp, i, args, param, pseudos)
-
-
-def run(posinp, i, args, param, pseudos):
-    try:
-        os.makedirs("{}_{:06}".format(args.name, i))
-        os.chdir("{}_{:06}".format(args.name, i))
-        job = Job(name=args.name, posinp=posinp, inputparams=param, pseudos=pseudos)
-        job.run(nmpi=args.nmpi)
-        copyfile(
-            "forces_{}.xyz".format(args.name),
-            "../../saved_results/{:06}.xyz".format(i),
+    displacements = RandomDisplacements(
+        len(positions[0]), seed=args.seed, distribution="uniform"
+    )
+    print("Random seed: {}".format(displacements.seed))
+    choices = np.random.default_rng(displacements.seed).integers(
+        len(positions), size=args.n_structs
+    )
+    for i, j in enumerate(choices):
+        posinp = displaced_posinp(positions[j], displacements[i])
+        run(posinp, i, args, param, pseudos, manifest, sink, displacements.seed)
+
+
+def run(posinp, i, args, param, pseudos, manifest, sink, seed=None):
+    Job = get_bigdft_job(args.backend)
+    workdir = JobDirectory("{}_{:06}".format(args.name, i), "{:06}.xyz".format(i))
+    track = manifest.track(workdir.name, i, seed, workdir.result_path)
+    output = "forces_{}.xyz".format(args.name)
+    if manifest.is_completed(workdir.name):
+        print("Calculation {:06} was complete.\n".format(i))
+    elif workdir.create():
+        job = Job(
+            name=args.name,
+            posinp=posinp,
+            inputparams=param,
+            pseudos=pseudos,
+            run_dir=workdir.path,
         )
-        os.chdir("../")
-    except OSError:
-        os.chdir("{}_{:06}".format(args.name, i))
-        try:
-            log = Logfile.from_file("log-" + args.name + ".yaml")
-            print("Calculation {:06} was complete.\n".format(i))
-        except:
-            job = Job(name=args.name, posinp=posinp, inputparams=param, pseudos=pseudos)
-            job.run(args.nmpi, restart_if_incomplete=True)
-            copyfile(
-                "forces_{}.xyz".format(args.name),
-                "../../saved_results/{:06}.xyz".format(i),
-            )
-        os.chdir("../")
-
-
-def generate_random_structure(initpos):
-    radius = 0.1
-    pos = deepcopy(initpos)
-    atoms_idx = np.arange(len(pos))
-    n_translations = np.random.randint(len(pos)) + 1
-    trans_idx = np.random.choice(atoms_idx, n_translations)
-    for j in trans_idx:
-        phi = 2 * np.pi * np.random.rand()
-        theta = np.arccos(2 * np.random.rand() - 1)
-        r = radius * np.random.rand()
-        pos = pos.translate_atom(
-            j,
-            [
-                r * np.sin(theta) * np.cos(phi),
-                r * np.sin(theta) * np.sin(phi),
-                r * np.cos(theta),
-            ],
+        with track:
+            run_bigdft_job(job, nmpi=args.nmpi)
+            workdir.save(output)
+            sink.collect(workdir, output, "bigdft", idx=i)
+    elif workdir.bigdft_completed(args.name):
+        # Jobs completed before the manifest existed
+        sink.collect(workdir, output, "bigdft", idx=i)
+        manifest.set_completed(workdir.name, i, seed, workdir.result_path)
+        print("Calculation {:06} was complete.\n".format(i))
+    else:
+        job = Job(
+            name=args.name,
+            posinp=posinp,
+            inputparams=param,
+            pseudos=pseudos,
+            run_dir=workdir.path,
         )
-    return pos
+        with track:
+            run_bigdft_job(job, nmpi=args.nmpi, restart_if_incomplete=True)
+            workdir.save(output)
+            sink.collect(workdir, output, "bigdft", idx=i)
 
 
 def create_parser():
@@ -106,6 +106,31 @@ def create_parser():
     parser.add_argument(
         "--nmpi", help="Number of mpi processes, default is 6.", type=int, default=6
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random displacements and configuration choices, "
+        "random if not given.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="dft",
+        help=BACKEND_HELP,
+    )
+    parser.add_argument(
+        "--results_db",
+        default=None,
+        help="Database where the energy and forces of each job are written "
+        "as soon as it finishes.",
+    )
+    parser.add_argument(
+        "--cleanup",
+        choices=CLEANUP_MODES,
+        default="keep",
+        help="What to do with the directory of a finished job.",
+    )
     return parser
 
 
@@ -1,87 +1,52 @@
 #! /usr/bin/env python
 
-from mlcalcdriver.base import Posinp, Atom
-from copy import deepcopy
 import numpy as np
 import argparse
 import sys
-from utils.calculations.graphene import generate_graphene_cell
+from utils.calculations.graphene import generate_graphene_cell, graphene_cell_arrays
+from utils.calculations.symmetry import (
+    OrbitEnumerator,
+    anchored_configurations,
+    lattice_permutations,
+)
 from utils.calculations.configurations import determine_unique_configurations
+from utils.calculations.cache import ConfigurationCache
+from utils.calculations.descriptors import (
+    LatticeDescriptors,
+    unique_anchored_configurations,
+)
 
 
 def main(args):
 
-    initpos = generate_graphene_cell(args.xsize, args.zsize)
-    configurations = []
-
-    if args.n_defects == 1:
-
-        initpos, _ = place_first_nitrogen(initpos)
-        configurations = [initpos]
-
-    elif args.n_defects == 2:
-
-        initpos, first_idx = place_first_nitrogen(initpos)
-        for i, at in enumerate(initpos):
-            new_pos = deepcopy(initpos)
-            if i != first_idx:
-                new_pos.atoms[i] = Atom("N", at.position)
-                configurations.append(new_pos)
-
-    elif args.n_defects == 3:
-
-        initpos, first_idx = place_first_nitrogen(initpos)
-        for i, at1 in enumerate(initpos):
-            if i != first_idx:
-                new_pos = deepcopy(initpos)
-                new_pos.atoms[i] = Atom("N", at1.position)
-                for j, at2 in enumerate(initpos):
-                    if j != first_idx and j > i:
-                        new_pos2 = deepcopy(new_pos)
-                        new_pos2.atoms[j] = Atom("N", at2.position)
-                        configurations.append(new_pos2)
-
-    elif args.n_defects == 4:
-
-        initpos, first_idx = place_first_nitrogen(initpos)
-        for i, at1 in enumerate(initpos):
-            if i != first_idx:
-                new_pos = deepcopy(initpos)
-                new_pos.atoms[i] = Atom("N", at1.position)
-                for j, at2 in enumerate(initpos):
-                    if j != first_idx and j > i:
-                        new_pos2 = deepcopy(new_pos)
-                        new_pos2.atoms[j] = Atom("N", at2.position)
-                        for k, at3 in enumerate(initpos):
-                            if k != first_idx and k > j:
-                                new_pos3 = deepcopy(new_pos2)
-                                new_pos3.atoms[k] = Atom("N", at3.position)
-                                configurations.append(new_pos3)
-
-    elif args.n_defects == 5:
-
-        initpos, first_idx = place_first_nitrogen(initpos)
-        for i, at1 in enumerate(initpos):
-            if i != first_idx:
-                new_pos = deepcopy(initpos)
-                new_pos.atoms[i] = Atom("N", at1.position)
-                for j, at2 in enumerate(initpos):
-                    if j != first_idx and j > i:
-                        new_pos2 = deepcopy(new_pos)
-                        new_pos2.atoms[j] = Atom("N", at2.position)
-                        for k, at3 in enumerate(initpos):
-                            if k != first_idx and k > j:
-                                new_pos3 = deepcopy(new_pos2)
-                                new_pos3.atoms[k] = Atom("N", at3.position)
-                                for m, at4 in enumerate(initpos):
-                                    if m != first_idx and m > k:
-                                        new_pos4 = deepcopy(new_pos3)
-                                        new_pos4.atoms[m] = Atom("N", at4.position)
-                                        configurations.append(new_pos4)
-
-    unique_configurations, count_configurations = determine_unique_configurations(
-        configurations
-    )
+    positions, cell = graphene_cell_arrays(args.xsize, args.zsize)
+    anchor = int(np.argmin(np.linalg.norm(positions - cell / 2, axis=1)))
+    settings = method_settings(args)
+
+    cache = ConfigurationCache(args.cache_dir)
+    cached = None
+    if not args.refresh:
+        cached = cache.load(args.xsize, args.zsize, args.n_defects, settings)
+    if cached is None:
+        unique_sites, count_configurations = find_unique_configurations(
+            args, positions, cell, anchor
+        )
+        cache.save(
+            args.xsize,
+            args.zsize,
+            args.n_defects,
+            settings,
+            unique_sites,
+            count_configurations,
+        )
+    else:
+        print("Read the unique configurations from the cache.")
+        unique_sites, count_configurations = cached
+    unique_configurations = [
+        generate_graphene_cell(args.xsize, args.zsize, dopants=sites)
+        for sites in unique_sites
+    ]
+
     print(
         "There are {} unique configurations, and {} configurations in total.".format(
             len(unique_configurations), np.sum(count_configurations)
@@ -95,15 +60,46 @@ def main(args):
             uni.write("{}_{:03}_(x{}).xyz".format(args.name, i, count))
 
 
-def place_first_nitrogen(posinp):
-    distances_to_middle = np.linalg.norm(
-        posinp.positions
-        - np.array((posinp.cell[0, 0], posinp.cell[1, 1], posinp.cell[2, 2])) / 2,
-        axis=1,
-    )
-    idx = np.argmin(distances_to_middle)
-    posinp.atoms[idx] = Atom("N", posinp.atoms[idx].position)
-    return posinp, idx
+def method_settings(args):
+    r"""
+    Returns the settings identifying the results of a method.
+    """
+    settings = {"method": args.method}
+    if args.method == "descriptors":
+        # The version tells apart the results of the exact descriptors
+        settings.update(n_gaussians=args.n_gaussians, decimals=args.decimals, version=2)
+    return settings
+
+
+def find_unique_configurations(args, positions, cell, anchor):
+
+    if args.method == "symmetry":
+        enumerator = OrbitEnumerator(lattice_permutations(positions, cell), anchor)
+        unique_sites, count_configurations = enumerator.unique(
+            args.n_defects, workers=args.workers
+        )
+
+    elif args.method == "descriptors":
+        unique_sites, count_configurations = unique_anchored_configurations(
+            LatticeDescriptors(
+                positions, cell, n_gaussians=args.n_gaussians, decimals=args.decimals
+            ),
+            anchor,
+            args.n_defects,
+            workers=args.workers,
+            enumerator=OrbitEnumerator(lattice_permutations(positions, cell), anchor),
+        )
+
+    elif args.method == "schnet":
+        sites = list(anchored_configurations(len(positions), anchor, args.n_defects))
+        posinps = [
+            generate_graphene_cell(args.xsize, args.zsize, dopants=s) for s in sites
+        ]
+        unique_posinps, count_configurations = determine_unique_configurations(posinps)
+        index = {id(pos): s for pos, s in zip(posinps, sites)}
+        unique_sites = [index[id(pos)] for pos in unique_posinps]
+
+    return unique_sites, count_configurations
 
 
 def create_parser():
@@ -128,6 +124,46 @@ def create_parser():
         action="store_true",
         help="If used, the unique positions will be written on disk.",
     )
+    parser.add_argument(
+        "--method",
+        choices=["symmetry", "descriptors", "schnet"],
+        default="symmetry",
+        help="Find the unique configurations with the symmetry operations of "
+        "the cell, by comparing descriptors of the lattice sites of one "
+        "configuration per symmetry orbit, or by "
+        "comparing untrained SchNet representations.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes enumerating the configurations.",
+    )
+    parser.add_argument(
+        "--n_gaussians",
+        type=int,
+        default=32,
+        help="Number of gaussians of the distance expansion of the descriptors.",
+    )
+    parser.add_argument(
+        "--decimals",
+        type=int,
+        default=3,
+        help="Number of decimals of the distances considered equal in the "
+        "descriptors.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default="unique_cache/",
+        help="Folder where the unique configurations are cached.",
+    )
+    parser.add_argument(
+        "--refresh",
+        default=False,
+        action="store_true",
+        help="If used, the unique configurations are found again and the "
+        "cached result is replaced.",
+    )
     return parser
 
 
@@ -2,7 +2,7 @@
 
 import argparse
 import ase
-from ase.db import connect
+from utils.database import bulk_write
 import ase.io.extxyz
 import h5py
 import numpy as np
@@ -27,6 +27,11 @@ def main(args):
         data = []
 
         for struct_name, struct_vals in in_db.items():
+            # Groups written before multiplicities were stored
+            if "multiplicity" in struct_vals:
+                multiplicities = struct_vals["multiplicity"][:]
+            else:
+                multiplicities = np.ones(len(struct_vals["coordinates"]), dtype=int)
             for i, pos in enumerate(struct_vals["coordinates"][:]):
                 data_point = {
                     "atomic_numbers": struct_vals["atomic_numbers"][:],
@@ -34,6 +39,7 @@ def main(args):
                     "coordinates": pos,
                     "dielectric": struct_vals["dielectric"][i],
                     "polarization": struct_vals["polarization"][i],
+                    "multiplicity": int(multiplicities[i]),
                 }
                 data.append(data_point)
 
@@ -49,23 +55,27 @@ def main(args):
             "dielectric": point["dielectric"].reshape(9),
             "polarization": point["polarization"],
         }
-        atoms.append(atom)
+        atoms.append((atom, point["multiplicity"]))
 
     if args.type == "tensoap":
         outname = (
             args.outname + ".xyz" if not args.outname.endswith(".xyz") else args.outname
         )
-        ase.io.extxyz.write_extxyz(outname, atoms)
+        # The xyz format has no weights, so replicated structures are repeated
+        ase.io.extxyz.write_extxyz(
+            outname, [atom for atom, count in atoms for _ in range(count)]
+        )
 
     elif args.type == "schnet":
         outname = (
             args.outname + ".db" if not args.outname.endswith(".db") else args.outname
         )
-        with connect(outname) as db:
-            for atom in atoms:
-                db.write(
+        bulk_write(
+            outname,
+            (
+                (
                     atom,
-                    data={
+                    {
                         "dielectric_full": atom.info["dielectric"].reshape(3, 3),
                         "dielectric_reduced": np.array(
                             [
@@ -79,7 +89,12 @@ def main(args):
                         ),
                         "polarization": atom.info["polarization"],
                     },
+                    # Read by the weighted sampler of training/schnet
+                    {"multiplicity": count} if count > 1 else {},
                 )
+                for atom, count in atoms
+            ),
+        )
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@
 
 from ase.io import read
 from utils.global_variables import DEFAULT_METADATA
-from ase.db import connect
+from utils.database import bulk_write
 import argparse
 
 
@@ -21,18 +21,19 @@ def create_parser():
 
 def main(args):
     dbname = args.dbname if args.dbname.endswith(".db") else args.dbname + ".db"
-    with open(args.filename) as infile, connect(dbname) as db:
-        db.metadata = DEFAULT_METADATA
-        atomslist = read(args.filename, index=":", format="vasp-xml")
-
-        for i, atoms in enumerate(atomslist):
-            if (i + 1) % args.keepstep == 0:
-                energy = atoms._calc.results["energy"]
-                forces = atoms._calc.results["forces"]
-                atoms.calc = None
-                db.write(atoms, data={"energy": energy, "forces": forces})
-            else:
-                continue
+    atomslist = read(args.filename, index=":", format="vasp-xml")
+    bulk_write(dbname, get_rows(atomslist, args.keepstep), metadata=DEFAULT_METADATA)
+
+
+def get_rows(atomslist, keepstep):
+    for i, atoms in enumerate(atomslist):
+        if (i + 1) % keepstep == 0:
+            energy = atoms._calc.results["energy"]
+            forces = atoms._calc.results["forces"]
+            atoms.calc = None
+            yield atoms, {"energy": energy, "forces": forces}
+        else:
+            continue
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import numpy as np
+import schnetpack as spk
+from ase.db import connect
+from torch.utils.data import WeightedRandomSampler
+
+
+def get_multiplicities(dbpath, key="multiplicity"):
+    r"""
+    Reads the multiplicity of every row of an ASE database.
+    Rows without the key have a multiplicity of 1.
+
+    Returns:
+        numpy array indexed like the schnetpack dataset (row id - 1),
+        the missing ids of a database with deleted rows have a
+        multiplicity of 1
+    """
+    ids, values = [], []
+    with connect(dbpath) as conn:
+        for row in conn.select(columns=["id", "key_value_pairs"]):
+            ids.append(row.id)
+            values.append(row.get(key, 1))
+    multiplicities = np.ones(max(ids, default=0), dtype=np.float64)
+    multiplicities[np.array(ids, dtype=int) - 1] = values
+    return multiplicities
+
+
+def get_weighted_train_loader(args, train_loader, logging=None):
+    r"""
+    Replaces the random sampler of the training loader by a weighted
+    sampler using the multiplicities stored in the database. Each epoch
+    draws as many samples as the replicated dataset would contain, so
+    the sampling statistics are the same as with duplicated rows.
+
+    Returns the original loader if no structure is replicated.
+    """
+    data_train = train_loader.dataset
+    multiplicities = get_multiplicities(data_train.dataset.dbpath)
+    weights = multiplicities[np.array(data_train.indices)]
+    if np.all(weights == 1):
+        return train_loader
+
+    if logging:
+        logging.info(
+            "weighted sampling of {} replicated structures...".format(
+                int(np.sum(weights > 1))
+            )
+        )
+    sampler = WeightedRandomSampler(
+        weights, num_samples=int(weights.sum()), replacement=True
+    )
+    return spk.data.AtomsLoader(
+        data_train,
+        batch_size=args.batch_size,
+        sampler=sampler,
+        num_workers=4,
+        pin_memory=args.cuda,
+    )
@@ -20,6 +20,7 @@ from schnetpack.utils.script_utils.parsing import build_parser
 from schnetpack.utils.script_utils.model import get_output_module
 from trainer import get_trainer
 from model import get_model
+from sampler import get_weighted_train_loader
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
@@ -51,6 +52,7 @@ def main(args):
     train_loader, val_loader, test_loader = get_loaders(
         args, dataset=dataset, split_path=split_path, logging=logging
     )
+    train_loader = get_weighted_train_loader(args, train_loader, logging=logging)
 
     # define metrics
     metrics = get_metrics(train_args)
@@ -1,3 +1,15 @@
 from .prepare_calculations import prepare_calculations
-from .graphene import generate_graphene_cell
+from .graphene import generate_graphene_cell, graphene_cell_arrays
 from .configurations import determine_unique_configurations
+from .symmetry import (
+    OrbitEnumerator,
+    anchored_configurations,
+    first_sites,
+    lattice_permutations,
+)
+from .descriptors import (
+    LatticeDescriptors,
+    unique_anchored_configurations,
+    unique_dopant_configurations,
+)
+from .cache import ConfigurationCache
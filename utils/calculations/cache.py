@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+__all__ = ["ConfigurationCache"]
+
+
+class ConfigurationCache:
+    r"""
+    On-disk cache of unique dopant configurations. Each result is a
+    small npz file holding the sites of the unique configurations and
+    their counts, named after the cell size, the number of defects
+    and a hash of the settings of the method that found them.
+
+    Parameters:
+    ------------
+    directory : str
+        (default : unique_cache/) folder of the cached results
+    """
+
+    def __init__(self, directory="unique_cache/"):
+        self.directory = directory
+
+    def path(self, xsize, zsize, n_defects, settings):
+        r"""
+        Returns the path of the file caching a result.
+
+        Parameters:
+        ------------
+        xsize, zsize : int
+            number of repetitions of the base cell
+        n_defects : int
+            number of defects
+        settings : dict
+            method and settings used to find the unique configurations
+        """
+        digest = hashlib.sha1(
+            json.dumps(settings, sort_keys=True).encode()
+        ).hexdigest()[:12]
+        return os.path.join(
+            self.directory,
+            "{}x{}_{}def_{}.npz".format(xsize, zsize, n_defects, digest),
+        )
+
+    def load(self, xsize, zsize, n_defects, settings):
+        r"""
+        Returns the cached unique configurations, as a list of tuples
+        of sites, and their counts, or None if they are not cached.
+        """
+        path = self.path(xsize, zsize, n_defects, settings)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            sites, counts = f["sites"], f["counts"]
+        return [tuple(int(i) for i in s) for s in sites], [int(c) for c in counts]
+
+    def save(self, xsize, zsize, n_defects, settings, sites, counts):
+        r"""
+        Writes unique configurations and their counts to the cache.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(xsize, zsize, n_defects, settings)
+        # Written under a temporary name so that a partial file is never read
+        tmp = path[:-4] + ".tmp.npz"
+        np.savez_compressed(
+            tmp,
+            sites=np.array(sites, dtype=np.int32).reshape(len(sites), n_defects),
+            counts=np.array(counts, dtype=np.int64),
+            settings=json.dumps(settings, sort_keys=True),
+        )
+        os.replace(tmp, path)
+        return path
@@ -7,12 +7,12 @@ from schnetpack.nn import CosineCutoff
 from schnetpack.environment import AseEnvironmentProvider
 
 
-def compare_reps(rep1, rep2):
+def compare_reps(rep1, rep2, atol=1e-04):
     at_list1 = [at for at in rep1]
     at_list2 = [at for at in rep2]
     for at1 in at_list1:
         for i, at2 in enumerate(at_list2):
-            if torch.allclose(at1, at2, atol=1e-04):
+            if torch.allclose(at1, at2, atol=atol):
                 del at_list2[i]
                 break
         else:
@@ -21,30 +21,82 @@ def compare_reps(rep1, rep2):
         return True
 
 
-def determine_unique_configurations(configurations):
+def rep_fingerprint(rep, atol=1e-04):
+    r"""
+    Returns the fingerprint of the per-atom representations of a
+    configuration, as bytes, and the quantized representations sorted
+    like the fingerprint. The representations are quantized on a grid
+    of atol, each atom is hashed with random weights, and the hashes
+    are sorted, so the fingerprint does not depend on the order of the
+    atoms.
+
+    Parameters:
+    ------------
+    rep : torch.Tensor
+        (n_atoms, n_features) representations of the configuration
+    atol : float
+        (default : 1e-04) tolerance of compare_reps on each value
+    """
+    quantized = np.rint(rep.double().numpy() / atol).astype(np.int64)
+    weights = np.random.default_rng(0).integers(
+        1, 2 ** 62, size=quantized.shape[1], dtype=np.int64
+    )
+    hashes = (quantized * weights).sum(axis=1)
+    # Atoms with the same hash are ordered by their quantized values
+    order = np.lexsort(np.concatenate([quantized.T[::-1], hashes[None]]))
+    return hashes[order].tobytes(), quantized[order]
+
+
+def determine_unique_configurations(configurations, atol=1e-04, batch_size=256):
     
     cutoff = float(np.max(configurations[0].cell.array) / 2 + 1)
 
     unique_reps, unique_config, reps, count_configs = [], [], [], []
     schnet = SchNet(
         n_atom_basis=32, n_filters=32, n_interactions = 1, cutoff=cutoff, cutoff_network=CosineCutoff
-    )
+    ).double()
     env = AseEnvironmentProvider(cutoff=cutoff)
 
-    data = [posinp_to_ase_atoms(pos) for pos in configurations]
-    data = SchnetPackData(data=data, environment_provider=env, collect_triples=False)
-    data_loader = AtomsLoader(data, batch_size=1)
+    atoms = [posinp_to_ase_atoms(pos) for pos in configurations]
+    data = SchnetPackData(data=atoms, environment_provider=env, collect_triples=False)
+    data_loader = AtomsLoader(data, batch_size=batch_size)
 
-    for batch in data_loader:
-        reps.append(torch.squeeze(schnet(batch)))
+    # The configurations have the same number of atoms, so the
+    # representations of a batch are not padded. The positions and
+    # cells are taken again from the atoms in double precision, so the
+    # representations of equivalent configurations only differ by
+    # rounding errors much smaller than atol
+    with torch.no_grad():
+        for start, batch in zip(range(0, len(atoms), batch_size), data_loader):
+            batch = {
+                k: v.double() if v.is_floating_point() else v for k, v in batch.items()
+            }
+            batch_atoms = atoms[start : start + batch_size]
+            batch["_positions"] = torch.from_numpy(
+                np.array([a.positions for a in batch_atoms])
+            )
+            batch["_cell"] = torch.from_numpy(
+                np.array([a.cell.array for a in batch_atoms])
+            )
+            reps.extend(schnet(batch))
 
+    # Configurations are only compared with the unique ones with the
+    # same fingerprint, and compare_reps is only used for the hash
+    # collisions between different quantized representations
+    buckets, unique_quantized = {}, []
     for i, rep in enumerate(reps):
-        for j, uni in enumerate(unique_reps):
-            if compare_reps(rep, uni):
+        fingerprint, quantized = rep_fingerprint(rep, atol)
+        bucket = buckets.setdefault(fingerprint, [])
+        for j in bucket:
+            if np.array_equal(quantized, unique_quantized[j]) or compare_reps(
+                rep, unique_reps[j], atol
+            ):
                 count_configs[j] += 1
                 break
         else:
+            bucket.append(len(unique_reps))
             unique_reps.append(rep)
+            unique_quantized.append(quantized)
             unique_config.append(configurations[i])
             count_configs.append(1)
     return unique_config, count_configs
@@ -0,0 +1,350 @@
+import numpy as np
+from collections import Counter
+from itertools import islice
+from functools import partial
+from multiprocessing import Pool
+from .symmetry import anchored_configurations, first_sites
+
+__all__ = [
+    "LatticeDescriptors",
+    "unique_dopant_configurations",
+    "unique_anchored_configurations",
+]
+
+
+class LatticeDescriptors:
+    r"""
+    Per-atom descriptors of substitutional defects in a fixed lattice,
+    with the form of a single SchNet interaction: each atom is
+    described by its species and by the sum, over the defects, of a
+    gaussian expansion of their distance with a cosine cutoff.
+
+    The filters between every pair of sites, including the periodic
+    images within the cutoff, are computed once for the pristine
+    lattice. The descriptors of a batch of configurations are then
+    sums of rows of the filters, without any neighbour search.
+
+    The descriptors are exact, so that equivalent configurations have
+    exactly the same ones. The distances equal to the given number of
+    decimals are replaced by a single value, and the filters are kept
+    as fixed point integers, whose sums do not depend on their order.
+
+    Parameters:
+    ------------
+    positions : (n_sites, 3) array
+        positions of the sites of the pristine cell
+    cell : (3,) array
+        lengths of the orthorhombic cell, 0 for non periodic directions
+    cutoff : float
+        (default : None) cutoff radius, half the largest cell length
+        plus one if None, as in determine_unique_configurations
+    n_gaussians : int
+        (default : 32) number of gaussians of the distance expansion
+    decimals : int
+        (default : 3) number of decimals of the distances considered equal
+    """
+
+    # Resolution of the fixed point filters
+    scale = 2**40
+
+    def __init__(self, positions, cell, cutoff=None, n_gaussians=32, decimals=3):
+        self.positions = np.asarray(positions, dtype=float)
+        self.cell = np.asarray(cell, dtype=float)
+        self.cutoff = (
+            float(np.max(self.cell) / 2 + 1) if cutoff is None else float(cutoff)
+        )
+        self.n_gaussians = int(n_gaussians)
+        self.decimals = int(decimals)
+        self.filters = self._filters()
+        # Random weights hashing the descriptors of each atom
+        self.weights = np.random.default_rng(0).integers(
+            1, 2**62, size=self.n_gaussians + 1, dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def settings(self):
+        return {
+            "cutoff": self.cutoff,
+            "n_gaussians": self.n_gaussians,
+            "decimals": self.decimals,
+        }
+
+    def _distances(self):
+        # Periodic images of the sites within the cutoff, from the
+        # vectors between the closest images of the sites
+        periodic = np.where(self.cell > 0, self.cell, np.inf)
+        ranges = [np.arange(-m, m + 1) for m in np.ceil(self.cutoff / periodic)]
+        shifts = np.stack(np.meshgrid(*ranges, indexing="ij"), -1).reshape(-1, 3)
+        vectors = self.positions[None, :, :] - self.positions[:, None, :]
+        vectors -= np.where(self.cell > 0, np.round(vectors / periodic), 0) * self.cell
+        distances = np.linalg.norm(
+            vectors[:, :, None, :] + (shifts * self.cell)[None, None, :, :], axis=-1
+        ).ravel()
+        # Groups of distances separated by less than the tolerance are
+        # replaced by their smallest value, without rounding boundaries
+        order = np.argsort(distances)
+        gaps = np.diff(distances[order], prepend=-np.inf) > 10**-self.decimals
+        groups = np.cumsum(gaps) - 1
+        distances[order] = distances[order][np.flatnonzero(gaps)][groups]
+        return distances.reshape(len(self), len(self), len(shifts))
+
+    def _filters(self):
+        distances = self._distances()
+        offsets = np.linspace(0, self.cutoff, self.n_gaussians)
+        width = offsets[1] - offsets[0]
+        within = (distances > 1e-8) & (distances < self.cutoff)
+        envelope = np.where(
+            within, 0.5 * (np.cos(np.pi * distances / self.cutoff) + 1), 0.0
+        )
+        gaussians = np.rint(
+            np.exp(-0.5 * ((distances[..., None] - offsets) / width) ** 2)
+            * envelope[..., None]
+            * self.scale
+        ).astype(np.int64)
+        # The first feature of the row of a dopant marks the dopant itself
+        filters = np.zeros((len(self), len(self), self.n_gaussians + 1), np.int64)
+        filters[np.arange(len(self)), np.arange(len(self)), 0] = self.scale
+        filters[:, :, 1:] = gaussians.sum(axis=2)
+        return filters
+
+    def __call__(self, dopants):
+        r"""
+        Returns the (n_configs, n_sites, n_gaussians + 1) descriptors of
+        a (n_configs, n_defects) array of dopant sites, as fixed point
+        integers.
+        """
+        dopants = np.asarray(dopants, dtype=np.int64)
+        descriptors = self.filters[dopants[:, 0]]
+        for sites in dopants[:, 1:].T:
+            descriptors += self.filters[sites]
+        return descriptors
+
+    def fingerprints(self, dopants):
+        r"""
+        Returns the fingerprints of a batch of configurations, as bytes.
+        The fingerprint is the sorted hashes of the per-atom descriptors,
+        so it does not depend on the order of the atoms.
+        """
+        hashes = np.sort(self._hashes(self(dopants)), axis=1)
+        return [h.tobytes() for h in hashes]
+
+    def sorted_descriptors(self, dopants):
+        r"""
+        Returns the descriptors of a batch of configurations, with the
+        atoms sorted by their hash, then by their descriptors.
+        """
+        descriptors = self(dopants)
+        keys = np.moveaxis(descriptors, -1, 0)[::-1]
+        order = np.lexsort(np.concatenate([keys, self._hashes(descriptors)[None]]))
+        return np.take_along_axis(descriptors, order[:, :, None], axis=1)
+
+    def _hashes(self, descriptors):
+        return (descriptors * self.weights).sum(axis=-1)
+
+
+class UniqueSet:
+    r"""
+    Unique configurations found so far, bucketed by fingerprint.
+    A configuration is compared exactly only with the unique ones
+    sharing its fingerprint, and the descriptors are only computed
+    for these comparisons.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.buckets = {}
+        self.configurations, self.counts = [], []
+
+    def add_batch(self, fingerprints, configurations, counts=None):
+        counts = [1] * len(configurations) if counts is None else counts
+        occurrences = Counter(fingerprints)
+        compared = [
+            i
+            for i, f in enumerate(fingerprints)
+            if occurrences[f] > 1 or f in self.buckets
+        ]
+        known = sorted(
+            {j for i in compared for j in self.buckets.get(fingerprints[i], [])}
+        )
+        descriptors = (
+            self.engine.sorted_descriptors(
+                [configurations[i] for i in compared]
+                + [self.configurations[j] for j in known]
+            )
+            if compared
+            else []
+        )
+        new = dict(zip(compared, descriptors[: len(compared)]))
+        unique = dict(zip(known, descriptors[len(compared) :]))
+
+        for i, (f, configuration, count) in enumerate(
+            zip(fingerprints, configurations, counts)
+        ):
+            bucket = self.buckets.setdefault(f, [])
+            for j in bucket:
+                if np.array_equal(new[i], unique[j]):
+                    self.counts[j] += count
+                    break
+            else:
+                if i in new:
+                    unique[len(self.configurations)] = new[i]
+                bucket.append(len(self.configurations))
+                self.configurations.append(configuration)
+                self.counts.append(count)
+
+    def items(self):
+        for fingerprint, bucket in self.buckets.items():
+            for j in bucket:
+                yield fingerprint, self.configurations[j], self.counts[j]
+
+
+_engine = None
+_enumerator = None
+
+
+def _init_worker(engine, enumerator=None):
+    global _engine, _enumerator
+    _engine = engine
+    _enumerator = enumerator
+
+
+def _add_batch(unique, batch):
+    counts = None
+    if _enumerator is not None:
+        # Only the canonical configuration of each orbit is described
+        canonical, multiplicities = _enumerator.check(batch)
+        batch, counts = batch[canonical], multiplicities[canonical].tolist()
+    if len(batch):
+        unique.add_batch(
+            _engine.fingerprints(batch),
+            [tuple(int(i) for i in configuration) for configuration in batch],
+            counts,
+        )
+
+
+def _unique_batch(batch):
+    unique = UniqueSet(_engine)
+    _add_batch(unique, batch)
+    return list(zip(*unique.items()))
+
+
+def _unique_anchored(first, anchor, n_defects, batch_size=2048):
+    unique = UniqueSet(_engine)
+    configurations = anchored_configurations(
+        len(_engine), anchor, n_defects, first=first
+    )
+    for batch in _batches(configurations, batch_size):
+        _add_batch(unique, batch)
+    return unique
+
+
+def _unique_partition(first, anchor, n_defects, batch_size=2048):
+    return list(zip(*_unique_anchored(first, anchor, n_defects, batch_size).items()))
+
+
+def _batches(configurations, batch_size):
+    configurations = iter(configurations)
+    while True:
+        batch = list(islice(configurations, batch_size))
+        if not batch:
+            return
+        yield np.array(batch, dtype=np.int64)
+
+
+def unique_dopant_configurations(engine, configurations, batch_size=2048, workers=1):
+    r"""
+    Finds the unique configurations of dopants in a lattice, by
+    comparing their descriptors. The configurations are described in
+    batches and deduplicated within each batch, then the unique ones
+    of every batch are merged. Only the sites of the unique
+    configurations are kept in memory.
+
+    Parameters:
+    ------------
+    engine : LatticeDescriptors
+        descriptors of the lattice
+    configurations : iterable of tuples
+        sites of the dopants of each configuration
+    batch_size : int
+        (default : 2048) number of configurations described together
+    workers : int
+        (default : 1) number of processes describing the batches
+
+    Returns:
+        the list of unique configurations, as tuples of sites,
+        and the list of their counts
+    """
+    unique = UniqueSet(engine)
+    batches = _batches(configurations, batch_size)
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(engine,)) as pool:
+            for local in pool.imap(_unique_batch, batches):
+                unique.add_batch(*local)
+    else:
+        _init_worker(engine)
+        for local in map(_unique_batch, batches):
+            unique.add_batch(*local)
+    return unique.configurations, unique.counts
+
+
+def unique_anchored_configurations(
+    engine, anchor, n_defects, batch_size=2048, workers=1, enumerator=None
+):
+    r"""
+    Finds the unique configurations of n_defects dopants with one on
+    the anchor, like unique_dopant_configurations. With several
+    workers, the configurations are split by their smallest site other
+    than the anchor, and each process streams and deduplicates the
+    configurations of its parts before the parts are merged.
+
+    Equivalent configurations usually fall in different parts, so
+    without an enumerator the merged parts hold several times the
+    number of unique configurations. With an enumerator, only the
+    canonical configuration of each orbit is described, with its
+    multiplicity as count, so every orbit reaches the merge once. The
+    descriptors only merge the orbits they do not tell apart.
+
+    Parameters:
+    ------------
+    engine : LatticeDescriptors
+        descriptors of the lattice
+    anchor : int
+        site of the first dopant
+    n_defects : int
+        number of dopants
+    batch_size : int
+        (default : 2048) number of configurations described together
+    workers : int
+        (default : 1) number of processes
+    enumerator : OrbitEnumerator
+        (default : None) symmetry operations of the lattice, with the
+        same anchor, used to skip the non canonical configurations
+
+    Returns:
+        the list of unique configurations, as tuples of sites,
+        and the list of their counts
+    """
+    if enumerator is not None and enumerator.anchor != anchor:
+        raise ValueError(
+            "The enumerator and the configurations have different anchors."
+        )
+    if workers <= 1 or n_defects < 2:
+        _init_worker(engine, enumerator)
+        unique = _unique_anchored(None, anchor, n_defects, batch_size)
+        return unique.configurations, unique.counts
+    unique = UniqueSet(engine)
+    function = partial(
+        _unique_partition,
+        anchor=anchor,
+        n_defects=n_defects,
+        batch_size=batch_size,
+    )
+    firsts = first_sites(len(engine), anchor, n_defects)
+    with Pool(workers, initializer=_init_worker, initargs=(engine, enumerator)) as pool:
+        for local in pool.imap(function, firsts):
+            if local:
+                unique.add_batch(*local)
+    return unique.configurations, unique.counts
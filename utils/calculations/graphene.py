@@ -2,22 +2,28 @@ import numpy as np
 from mlcalcdriver import Posinp
 
 
-def generate_graphene_cell(xsize, zsize):
+def graphene_cell_arrays(xsize, zsize):
     base_cell = np.array([2.4674318, 0, 4.2737150])
-    positions = []
     reduced_pos = np.array(
         [[0, 0, 0], [0, 0, 1.0 / 3], [0.5, 0, 0.5], [0.5, 0, 5.0 / 6]]
     )
+    positions = []
     for i in range(xsize):
         for j in range(zsize):
-            p = (np.array([i, 0, j]) + reduced_pos) * base_cell
-            for pi in p:
-                positions.append({"C": pi})
+            positions.append((np.array([i, 0, j]) + reduced_pos) * base_cell)
+    return np.concatenate(positions), base_cell * np.array([xsize, 0, zsize])
+
+
+def generate_graphene_cell(xsize, zsize, dopants=None, dopant="N"):
+    dopants = [] if dopants is None else dopants
+    positions, cell = graphene_cell_arrays(xsize, zsize)
+    types = np.full(len(positions), "C", dtype=object)
+    types[np.asarray(dopants, dtype=int)] = dopant
 
     pos_dict = {
         "units": "angstroem",
-        "cell": base_cell * np.array([xsize, 0, zsize]),
-        "positions": positions,
+        "cell": cell,
+        "positions": [{t: p} for t, p in zip(types, positions)],
     }
     pos = Posinp.from_dict(pos_dict)
     return pos
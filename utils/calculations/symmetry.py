@@ -0,0 +1,255 @@
+import numpy as np
+from itertools import combinations, islice
+from functools import partial
+from multiprocessing import Pool
+from scipy.spatial import cKDTree
+
+__all__ = [
+    "lattice_permutations",
+    "first_sites",
+    "anchored_configurations",
+    "OrbitEnumerator",
+]
+
+
+def planar_point_operations():
+    r"""
+    Returns the 12 operations of the hexagonal point group in the
+    (x, z) plane of the graphene cells, as (12, 2, 2) matrices.
+    """
+    operations = []
+    for m in range(6):
+        angle = m * np.pi / 3
+        c, s = np.cos(angle), np.sin(angle)
+        rotation = np.array([[c, -s], [s, c]])
+        operations.append(rotation)
+        operations.append(rotation @ np.diag([1.0, -1.0]))
+    return np.array(operations)
+
+
+def lattice_permutations(positions, cell, tol=1e-3):
+    r"""
+    Finds the symmetry operations of a periodic two-dimensional cell,
+    as the permutations of the sites they induce. The candidate
+    operations are the hexagonal point operations compatible with the
+    periodicity of the cell, followed by every translation bringing
+    the first site on another site. The ones mapping every site on a
+    site are kept.
+
+    Parameters:
+    ------------
+    positions : (n_sites, 3) array
+        positions of the sites, in the (x, z) plane
+    cell : (3,) array
+        lengths of the orthorhombic cell, the y direction is ignored
+    tol : float
+        (default : 1e-3) distance under which two sites are the same
+
+    Returns:
+        (n_operations, n_sites) int array, site i is sent to
+        permutations[g, i] by operation g
+    """
+    boxsize = np.asarray(cell, dtype=float)[[0, 2]]
+    sites = np.mod(np.asarray(positions, dtype=float)[:, [0, 2]], boxsize)
+    tree = cKDTree(sites, boxsize=boxsize)
+    n_sites = len(sites)
+
+    permutations = []
+    for operation in planar_point_operations():
+        # The operation must also map the periodic images on each other
+        lattice = np.mod(np.diag(boxsize) @ operation.T + tol, boxsize) - tol
+        if np.any(np.abs(lattice) > tol):
+            continue
+        rotated = sites @ operation.T
+        translations = sites - rotated[0]
+        images = np.mod(rotated[None, :, :] + translations[:, None, :], boxsize)
+        distances, indices = tree.query(images.reshape(-1, 2))
+        distances = distances.reshape(n_sites, n_sites)
+        indices = indices.reshape(n_sites, n_sites)
+        for perm, dist in zip(indices, distances):
+            if np.all(dist < tol) and len(np.unique(perm)) == n_sites:
+                permutations.append(perm)
+    return np.unique(np.array(permutations), axis=0)
+
+
+def first_sites(n_sites, anchor, n_defects):
+    r"""
+    Returns the possible smallest sites other than the anchor of the
+    configurations with a defect on the anchor, used to split their
+    enumeration in independent parts.
+    """
+    others = [i for i in range(n_sites) if i != anchor]
+    return others[: len(others) - n_defects + 2] if n_defects > 1 else []
+
+
+def anchored_configurations(n_sites, anchor, n_defects, first=None):
+    r"""
+    Yields every configuration of n_defects identical defects on n_sites
+    sites with a defect on the anchor, as a sorted tuple of sites.
+
+    Parameters:
+    ------------
+    n_sites : int
+        number of sites
+    anchor : int
+        site of the first defect
+    n_defects : int
+        number of defects
+    first : int
+        (default : None) if given, only the configurations whose smallest
+        site other than the anchor is first are generated
+    """
+    others = [i for i in range(n_sites) if i != anchor]
+    if n_defects == 1:
+        if first is None:
+            yield (anchor,)
+        return
+    if first is None:
+        rest = combinations(others, n_defects - 1)
+    else:
+        rest = (
+            (first,) + c
+            for c in combinations([i for i in others if i > first], n_defects - 2)
+        )
+    for c in rest:
+        yield tuple(sorted((anchor,) + c))
+
+
+class OrbitEnumerator:
+    r"""
+    Enumerates the configurations of identical defects on the sites
+    of a cell, up to the symmetry operations of the cell. Every site
+    must be equivalent to the anchor, as in pristine graphene, so
+    every orbit has configurations with a defect on the anchor.
+
+    Only the configurations with a defect on the anchor are generated.
+    A configuration is kept if it is the smallest, in lexicographic
+    order, of its images containing the anchor. The multiplicity of
+    a configuration is its number of images containing the anchor,
+    so that the multiplicities sum to the number of configurations
+    with a defect on the anchor.
+
+    Parameters:
+    ------------
+    permutations : (n_operations, n_sites) int array
+        symmetry operations, from lattice_permutations
+    anchor : int
+        (default : 0) site of the first defect
+    """
+
+    def __init__(self, permutations, anchor=0):
+        self.permutations = np.asarray(permutations, dtype=np.int64)
+        self.n_sites = self.permutations.shape[1]
+        self.anchor = int(anchor)
+        # to_anchor[d] are the operations sending site d on the anchor
+        to_anchor = [
+            self.permutations[self.permutations[:, d] == self.anchor]
+            for d in range(self.n_sites)
+        ]
+        if len(set(len(ops) for ops in to_anchor)) != 1 or len(to_anchor[0]) == 0:
+            raise ValueError("The sites are not all equivalent by symmetry.")
+        self.to_anchor = np.array(to_anchor)
+
+    def configurations(self, n_defects, first=None):
+        return anchored_configurations(
+            self.n_sites, self.anchor, n_defects, first=first
+        )
+
+    def orbits(self, n_defects, first=None, batch_size=8192):
+        r"""
+        Lazily yields the canonical configuration of each orbit, as
+        a tuple of sites, with its multiplicity.
+
+        Parameters:
+        ------------
+        n_defects : int
+            number of defects
+        first : int
+            (default : None) only check the configurations whose smallest
+            site other than the anchor is first, to split the work
+        batch_size : int
+            (default : 8192) number of configurations checked together
+        """
+        configurations = self.configurations(n_defects, first=first)
+        while True:
+            batch = list(islice(configurations, batch_size))
+            if not batch:
+                return
+            batch = np.array(batch, dtype=np.int64)
+            canonical, multiplicities = self.check(batch)
+            for config, multiplicity in zip(
+                batch[canonical], multiplicities[canonical]
+            ):
+                yield tuple(int(i) for i in config), int(multiplicity)
+
+    def unique(self, n_defects, workers=1):
+        r"""
+        Returns the canonical configurations of all the orbits and their
+        multiplicities, as two lists. With several workers, the
+        configurations are split by their smallest site other than the
+        anchor and each part is enumerated by a process. The canonical
+        configurations do not depend on the split, so the parts are only
+        concatenated, in the order of the serial enumeration.
+
+        Parameters:
+        ------------
+        n_defects : int
+            number of defects
+        workers : int
+            (default : 1) number of processes
+        """
+        if workers > 1 and n_defects > 1:
+            firsts = first_sites(self.n_sites, self.anchor, n_defects)
+            with Pool(workers, initializer=_init_worker, initargs=(self,)) as pool:
+                parts = pool.imap(partial(_orbits_from, n_defects=n_defects), firsts)
+                orbits = [orbit for part in parts for orbit in part]
+        else:
+            orbits = list(self.orbits(n_defects))
+        return [o[0] for o in orbits], [o[1] for o in orbits]
+
+    def check(self, batch):
+        r"""
+        Returns which configurations of a (n_configurations, n_defects)
+        array of sorted sites are canonical, and their multiplicities.
+        """
+        n_configs, n_defects = batch.shape
+        n_ops = self.to_anchor.shape[1]
+        # Images of every configuration by the operations sending
+        # one of its sites on the anchor
+        images = self.to_anchor[
+            batch[:, :, None, None],
+            np.arange(n_ops)[None, None, :, None],
+            batch[:, None, None, :],
+        ].reshape(n_configs, n_defects * n_ops, n_defects)
+        images.sort(axis=2)
+
+        diff = images - batch[:, None, :]
+        nonzero = diff != 0
+        first_diff = np.take_along_axis(
+            diff, nonzero.argmax(axis=2)[:, :, None], axis=2
+        )[:, :, 0]
+        canonical = ~np.any(nonzero.any(axis=2) & (first_diff < 0), axis=1)
+
+        if self.n_sites**n_defects < 2**63:
+            keys = np.zeros(images.shape[:2], dtype=np.int64)
+            for j in range(n_defects):
+                keys = keys * self.n_sites + images[:, :, j]
+            keys.sort(axis=1)
+            multiplicities = 1 + np.count_nonzero(np.diff(keys, axis=1), axis=1)
+        else:
+            multiplicities = np.array(
+                [len(np.unique(image, axis=0)) for image in images]
+            )
+        return canonical, multiplicities
+
+
+_enumerator = None
+
+
+def _init_worker(enumerator):
+    global _enumerator
+    _enumerator = enumerator
+
+
+def _orbits_from(first, n_defects):
+    return list(_enumerator.orbits(n_defects, first=first))
@@ -0,0 +1,2 @@
+from .bulk import BulkWriter, bulk_write
+from .ingestion import IngestionIndex
@@ -0,0 +1,163 @@
+import time
+from collections import deque
+from ase.db import connect
+from ase.db.row import AtomsRow
+from ase.db.sqlite import SQLite3Database, all_tables, index_statements
+
+__all__ = ["BulkWriter", "bulk_write"]
+
+
+class BulkWriter:
+    r"""
+    Context manager writing rows in an ASE database with batched
+    transactions. For SQLite databases, the secondary indices are
+    dropped while writing and created once at the end, and no lock
+    file is used, so there should be a single writer at a time.
+
+    Parameters:
+    ------------
+    dbname : str
+        path to the database
+    batch_size : int
+        (default : 10000) number of rows written between commits
+    metadata : dict
+        (default : None) metadata of the database, if not None
+    append : bool
+        (default : True) if False, the database is overwritten
+    verbose : bool
+        (default : True) if True, the writing rate is printed at the end
+    """
+
+    def __init__(
+        self, dbname, batch_size=10000, metadata=None, append=True, verbose=True
+    ):
+        self.dbname = str(dbname)
+        self.batch_size = int(batch_size)
+        self.metadata = metadata
+        self.append = append
+        self.verbose = verbose
+        self.db = None
+        self.replaced = deque()
+
+    def __enter__(self):
+        self.db = connect(
+            self.dbname, create_indices=False, use_lock_file=False, append=self.append
+        )
+        self.count = 0
+        self.start_time = time.time()
+        if self.is_sqlite:
+            self.db.__enter__()
+            self._drop_indices()
+        if self.metadata is not None:
+            self.db.metadata = self.metadata
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None and self.replaced:
+                # Rows to replace that were not overwritten
+                self.delete(self.replaced)
+            if self.is_sqlite:
+                if exc_type is not None:
+                    # The indices were dropped outside of the transaction,
+                    # so they are created again after the rollback
+                    self.db.connection.rollback()
+                self._create_indices()
+        finally:
+            self.replaced.clear()
+            if self.is_sqlite:
+                self.db.__exit__(exc_type, exc_value, tb)
+        if exc_type is None and self.verbose:
+            elapsed = time.time() - self.start_time
+            print(
+                "Wrote {} rows in {:.1f} s ({:.0f} rows/s).".format(
+                    self.count, elapsed, self.count / max(elapsed, 1e-12)
+                )
+            )
+        self.db = None
+
+    @property
+    def is_sqlite(self):
+        return isinstance(self.db, SQLite3Database)
+
+    def write(self, atoms, data=None, **key_value_pairs):
+        r"""
+        Writes a single row and returns its id. atoms can be
+        an ase.Atoms or an AtomsRow. The row overwrites the next
+        row given to replace, if any, and is appended otherwise.
+        """
+        id = self.replaced.popleft() if self.replaced else None
+        if data is None:
+            id = self.db.write(atoms, id=id, **key_value_pairs)
+        else:
+            id = self.db.write(atoms, data=data, id=id, **key_value_pairs)
+        self.count += 1
+        if self.is_sqlite and self.count % self.batch_size == 0:
+            self.db.connection.commit()
+        return id
+
+    def write_many(self, rows):
+        r"""
+        Writes every element of an iterable of rows. Each element is an
+        AtomsRow, an (atoms, data) pair or an (atoms, data, key_value_pairs)
+        tuple. Returns the list of ids.
+        """
+        ids = []
+        for row in rows:
+            if isinstance(row, AtomsRow):
+                ids.append(self.write(row))
+            elif len(row) == 2:
+                ids.append(self.write(row[0], data=row[1]))
+            else:
+                ids.append(self.write(row[0], data=row[1], **row[2]))
+        return ids
+
+    def replace(self, ids):
+        r"""
+        Marks rows to be overwritten by the next rows written, in
+        order, so the ids of the database stay contiguous. The rows
+        that are not overwritten are deleted at the end.
+        """
+        self.replaced.extend(int(id) for id in ids)
+
+    def delete(self, ids):
+        r"""
+        Deletes rows inside the current transaction. Unlike
+        Database.delete, the database is not vacuumed.
+        """
+        ids = [(int(id),) for id in ids]
+        if not self.is_sqlite:
+            self.db.delete([id[0] for id in ids])
+            return
+        for table in all_tables[::-1]:
+            self.db.connection.executemany(
+                "DELETE FROM {} WHERE id=?".format(table), ids
+            )
+
+    def _drop_indices(self):
+        for statement in index_statements:
+            name = statement.split()[2]
+            self.db.connection.execute("DROP INDEX IF EXISTS {}".format(name))
+
+    def _create_indices(self):
+        con = self.db.connection
+        # The tables do not exist if nothing was written
+        cur = con.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='systems'")
+        if cur.fetchone()[0] == 0:
+            return
+        for statement in index_statements:
+            con.execute(
+                statement.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1)
+            )
+
+
+def bulk_write(dbname, rows, **kwargs):
+    r"""
+    Writes an iterable of rows (see BulkWriter.write_many) in an ASE
+    database. The keyword arguments are passed to BulkWriter.
+
+    Returns:
+        list of the ids of the written rows
+    """
+    with BulkWriter(dbname, **kwargs) as writer:
+        return writer.write_many(rows)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+
+__all__ = ["IngestionIndex", "file_hash"]
+
+
+class IngestionIndex:
+    r"""
+    Index of the output files already written in a database.
+
+    Files are keyed by their absolute path and the index keeps their size,
+    modification time and content hash, as well as the rows they produced.
+    The index is saved as a json file next to the database.
+
+    Parameters:
+    ------------
+    dbname : str
+        Path to the database (.db or .h5) being indexed.
+    """
+
+    def __init__(self, dbname):
+        self.path = str(dbname) + ".index.json"
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def __contains__(self, filename):
+        return self._key(filename) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def needs_update(self, filename):
+        r"""
+        Returns True if the file is not in the index or has changed
+        since it was written. The content hash is only computed when the
+        size or modification time differ from the indexed values.
+        """
+        entry = self.entries.get(self._key(filename))
+        if entry is None:
+            return True
+        stat = os.stat(filename)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return False
+        if entry["sha256"] == file_hash(filename):
+            entry["mtime"] = stat.st_mtime
+            return False
+        return True
+
+    def rows(self, filename):
+        entry = self.entries.get(self._key(filename))
+        return [] if entry is None else list(entry["rows"])
+
+    def record(self, filename, rows):
+        stat = os.stat(filename)
+        self.entries[self._key(filename)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_hash(filename),
+            "rows": [int(row) for row in rows],
+        }
+
+    def clear(self):
+        self.entries = {}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _key(filename):
+        return os.path.abspath(filename)
+
+
+def file_hash(filename, blocksize=1 << 20):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
@@ -1 +1,4 @@
 from .square_lattice import create_2d_square_data
+from .displacements import RandomDisplacements, displaced_posinp, displaced_atoms
+from .uncertainty import committee_scores, select_most_uncertain
+from .defects import DefectSampler
@@ -0,0 +1,154 @@
+import numpy as np
+
+__all__ = ["DefectSampler"]
+
+
+class DefectSampler:
+    r"""
+    Samples the sites of substitutional defects in a pristine cell.
+    The first defect is on the site closest to the center of the cell.
+    Each other defect is placed around a point at a given angle and
+    radius from the first one, with gaussian weights on the distance
+    between the sites and the point. Occupied sites are excluded.
+
+    The periodic displacements and distances between the sites are
+    computed once, and the defects of all the structures are drawn
+    together with numpy arrays.
+
+    Parameters:
+    ------------
+    positions : (n_sites, 3) array
+        positions of the sites of the pristine cell
+    cell : (3,) array
+        lengths of the orthorhombic cell, 0 for non periodic directions
+    seed : int
+        (default : None) seed of the random generator, random if None
+    width : float
+        (default : 1.0) standard deviation of the gaussian weights
+    """
+
+    def __init__(self, positions, cell, seed=None, width=1.0):
+        self.positions = np.asarray(positions, dtype=float)
+        self.cell = np.asarray(cell, dtype=float)
+        self.seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+        self.rng = np.random.default_rng(self.seed)
+        self.width = float(width)
+
+        self.center = int(
+            np.argmin(np.linalg.norm(self.positions - self.cell / 2, axis=1))
+        )
+        vectors = self.minimum_image(
+            self.positions[None, :, :] - self.positions[:, None, :]
+        )
+        self.distances = np.linalg.norm(vectors, axis=-1)
+        self.center_vectors = vectors[self.center]
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def max_radius(self):
+        return np.max(self.cell) / 2
+
+    def minimum_image(self, vectors):
+        periodic = self.cell > 0
+        vectors = np.array(vectors, dtype=float)
+        vectors[..., periodic] -= self.cell[periodic] * np.round(
+            vectors[..., periodic] / self.cell[periodic]
+        )
+        return vectors
+
+    def grid_placements(self, n_structs, min_radius=1.0):
+        r"""
+        Returns the angles and radiuses of a regular grid of about n_structs
+        placements of a single defect, as (n_placements, 1) arrays.
+        """
+        root = np.sqrt(n_structs)
+        if root % 1 == 0:
+            n_angle, n_radius = int(root), int(root)
+        else:
+            n_angle, n_radius = int(np.ceil(root)), int(np.floor(root))
+        radiuses = np.linspace(min_radius, self.max_radius, n_radius)
+        angles = np.linspace(0, 2 * np.pi, n_angle)
+        angles, radiuses = np.meshgrid(angles, radiuses, indexing="ij")
+        return angles.reshape(-1, 1), radiuses.reshape(-1, 1)
+
+    def random_placements(self, n_structs, n_placements, min_radius=1.0):
+        r"""
+        Returns random angles and radiuses for n_placements defects
+        in each of n_structs structures, as (n_structs, n_placements)
+        arrays. The placements are uniform in the disk between
+        min_radius and max_radius.
+        """
+        shape = (n_structs, n_placements)
+        angles = 2 * np.pi * self.rng.random(shape)
+        radiuses = np.sqrt(
+            self.rng.uniform(min_radius ** 2, self.max_radius ** 2, size=shape)
+        )
+        return angles, radiuses
+
+    def sample(self, angles, radiuses, batch_size=4096):
+        r"""
+        Draws the sites of the defects.
+
+        Parameters:
+        ------------
+        angles : (n_structs, n_defects - 1) array
+            angles of the placements in the plane of the cell
+        radiuses : (n_structs, n_defects - 1) array
+            distances of the placements from the first defect
+        batch_size : int
+            (default : 4096) number of structures drawn together
+
+        Returns:
+            (n_structs, n_defects) array of site indices, the first
+            column being the first defect
+        """
+        angles = np.asarray(angles, dtype=float)
+        radiuses = np.asarray(radiuses, dtype=float)
+        n_structs, n_placements = angles.shape
+        sites = np.empty((n_structs, n_placements + 1), dtype=np.int64)
+        sites[:, 0] = self.center
+        for start in range(0, n_structs, batch_size):
+            batch = slice(start, min(start + batch_size, n_structs))
+            sites[batch, 1:] = self._sample_batch(angles[batch], radiuses[batch])
+        return sites
+
+    def _sample_batch(self, angles, radiuses):
+        n_structs, n_placements = angles.shape
+        occupied = np.zeros((n_structs, len(self)), dtype=bool)
+        occupied[:, self.center] = True
+        sites = np.empty((n_structs, n_placements), dtype=np.int64)
+        for k in range(n_placements):
+            offsets = np.stack(
+                [
+                    radiuses[:, k] * np.cos(angles[:, k]),
+                    np.zeros(n_structs),
+                    radiuses[:, k] * np.sin(angles[:, k]),
+                ],
+                axis=-1,
+            )
+            distances = np.linalg.norm(
+                self.minimum_image(
+                    self.center_vectors[None, :, :] - offsets[:, None, :]
+                ),
+                axis=-1,
+            )
+            weights = np.exp(-(distances ** 2) / (2 * self.width ** 2))
+            weights[occupied] = 0
+            cumulative = np.cumsum(weights, axis=1)
+            draws = self.rng.random(n_structs) * cumulative[:, -1]
+            sites[:, k] = np.minimum(
+                (cumulative <= draws[:, None]).sum(axis=1), len(self) - 1
+            )
+            occupied[np.arange(n_structs), sites[:, k]] = True
+        return sites
+
+    def pair_distances(self, sites):
+        r"""
+        Returns the periodic distances between the defects of each
+        structure, as a (n_structs, n_defects * (n_defects - 1) / 2) array.
+        """
+        sites = np.asarray(sites)
+        i, j = np.triu_indices(sites.shape[1], k=1)
+        return self.distances[sites[:, i], sites[:, j]]
@@ -0,0 +1,152 @@
+import numpy as np
+from copy import deepcopy
+from functools import lru_cache
+
+__all__ = ["RandomDisplacements", "displaced_posinp", "displaced_atoms"]
+
+
+class RandomDisplacements:
+    r"""
+    Random displacements of the atoms of a structure, addressed by
+    structure index. A random number of atoms (drawn with replacement)
+    are moved in a random direction, by a random norm.
+
+    The displacements are drawn in blocks of structures, each block
+    having its own random stream derived from the seed. Structure i
+    is always the same for a given seed, whether it is generated alone
+    or with others.
+
+    Parameters:
+    ------------
+    n_atoms : int
+        number of atoms in the structure
+    seed : int
+        (default : None) seed of the random streams, random if None
+    radius : float
+        (default : 0.1) scale of the displacement norms
+    distribution : str
+        (default : halfnormal) distribution of the norms,
+        halfnormal : absolute value of a normal of scale radius
+        ball : uniform in the ball of radius radius
+        uniform : uniform between 0 and radius
+    block_size : int
+        (default : 256) number of structures drawn from the same stream
+    """
+
+    def __init__(
+        self,
+        n_atoms,
+        seed=None,
+        radius=0.1,
+        distribution="halfnormal",
+        block_size=256,
+    ):
+        if distribution not in ["halfnormal", "ball", "uniform"]:
+            raise ValueError("Unknown distribution {}.".format(distribution))
+        self.n_atoms = int(n_atoms)
+        self.seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+        self.radius = float(radius)
+        self.distribution = distribution
+        self.block_size = int(block_size)
+
+    def __getitem__(self, i):
+        return self.batch([i])[0]
+
+    def batch(self, indices):
+        r"""
+        Returns the displacements of the structures in indices,
+        as a (len(indices), n_atoms, 3) array.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        displacements = np.empty((len(indices), self.n_atoms, 3))
+        blocks = indices // self.block_size
+        for block in np.unique(blocks):
+            where = np.flatnonzero(blocks == block)
+            displacements[where] = self._block(block)[indices[where] % self.block_size]
+        return displacements
+
+    def iter_batches(self, n_structs, batch_size=None):
+        r"""
+        Yields the displacements of structures 0 to n_structs - 1,
+        one block at a time.
+        """
+        batch_size = self.block_size if batch_size is None else batch_size
+        for start in range(0, n_structs, batch_size):
+            yield self.batch(np.arange(start, min(start + batch_size, n_structs)))
+
+    def _block(self, block):
+        return _draw_block(
+            self.seed,
+            self.n_atoms,
+            self.radius,
+            self.distribution,
+            self.block_size,
+            int(block),
+        )
+
+
+@lru_cache(maxsize=4)
+def _draw_block(seed, n_atoms, radius, distribution, block_size, block):
+    # Cached at the module level, so single structures looked up one
+    # after the other, in the same process, reuse the drawn block
+    rng = np.random.default_rng([seed, block])
+    shape = (block_size, n_atoms)
+
+    n_translations = rng.integers(1, n_atoms + 1, size=block_size)
+    trans_idx = rng.integers(n_atoms, size=shape)
+    phi = 2 * np.pi * rng.random(shape)
+    cos_theta = 2 * rng.random(shape) - 1
+    if distribution == "halfnormal":
+        r = np.abs(rng.normal(scale=radius, size=shape))
+    elif distribution == "ball":
+        r = radius * np.cbrt(rng.random(shape))
+    elif distribution == "uniform":
+        r = radius * rng.random(shape)
+    # Only the first n_translations draws of each structure are used
+    r[np.arange(n_atoms)[None, :] >= n_translations[:, None]] = 0
+
+    sin_theta = np.sqrt(1 - cos_theta**2)
+    vectors = np.stack(
+        [r * sin_theta * np.cos(phi), r * sin_theta * np.sin(phi), r * cos_theta],
+        axis=-1,
+    )
+    flat_idx = (np.arange(block_size)[:, None] * n_atoms + trans_idx).reshape(-1)
+    # Atoms drawn more than once are displaced by the sum of the vectors
+    displacements = np.stack(
+        [
+            np.bincount(
+                flat_idx,
+                weights=vectors[..., k].reshape(-1),
+                minlength=block_size * n_atoms,
+            )
+            for k in range(3)
+        ],
+        axis=-1,
+    ).reshape(block_size, n_atoms, 3)
+    # The cached block is shared by every lookup
+    displacements.flags.writeable = False
+    return displacements
+
+
+def displaced_posinp(initpos, displacement):
+    r"""
+    Returns a copy of a Posinp with the displacement added
+    to the positions of the atoms. The atoms are not copied: the
+    copy shares the atoms that do not move, and the moved atoms
+    are replaced by new ones.
+    """
+    pos = deepcopy(initpos, {id(atom): atom for atom in initpos.atoms})
+    Atom = type(pos.atoms[0])
+    for j in np.flatnonzero(np.any(displacement != 0, axis=1)):
+        pos.atoms[j] = Atom(pos.atoms[j].type, pos.atoms[j].position + displacement[j])
+    return pos
+
+
+def displaced_atoms(initatoms, displacement):
+    r"""
+    Returns a copy of an ase.Atoms with the displacement added
+    to the positions of the atoms.
+    """
+    at = initatoms.copy()
+    at.set_positions(at.positions + displacement)
+    return at
@@ -2,7 +2,7 @@ import numpy as np
 from ase.calculators.lj import LennardJones
 from ase import Atoms
 from copy import deepcopy
-from ase.db import connect
+from utils.database import bulk_write
 
 
 def create_2d_square_data(ndata, size, dbname):
@@ -26,19 +26,22 @@ def create_2d_square_data(ndata, size, dbname):
     init_atoms.set_calculator(calculator)
 
     dbname = dbname if dbname.endswith(".db") else dbname + ".db"
-    with connect(dbname) as db:
-        for _ in range(ndata):
-            atoms = deepcopy(init_atoms)
-            disp = get_random_displacement(size, d)
-            atoms.set_positions(atoms.positions + disp)
-            db.write(
-                atoms,
-                data={
-                    "energy": atoms.get_total_energy(),
-                    "forces": atoms.get_forces(),
-                    "displacements": disp,
-                },
-            )
+    bulk_write(dbname, generate_rows(init_atoms, ndata, size, d))
+
+
+def generate_rows(init_atoms, ndata, size, d):
+    for _ in range(ndata):
+        atoms = deepcopy(init_atoms)
+        disp = get_random_displacement(size, d)
+        atoms.set_positions(atoms.positions + disp)
+        yield (
+            atoms,
+            {
+                "energy": atoms.get_total_energy(),
+                "forces": atoms.get_forces(),
+                "displacements": disp,
+            },
+        )
 
 
 def get_random_displacement(size, d):
@@ -0,0 +1,73 @@
+import numpy as np
+from ase import Atoms
+from .displacements import displaced_atoms, displaced_posinp
+
+__all__ = ["committee_scores", "select_most_uncertain"]
+
+
+def committee_scores(
+    structure, displacements, indices, calculator, prop, batch_size=256
+):
+    r"""
+    Scores candidate structures by the disagreement of a committee of
+    models, in batches. The candidates are the displacements of the
+    structure given by the indices. They are built like in the jobs,
+    so the scored structures are the ones that are calculated.
+
+    Parameters:
+    ------------
+    structure : ase.Atoms or mybigdft.Posinp
+        initial structure, displaced in its own units
+    displacements : utils.datagen.RandomDisplacements
+        random displacements of the structure
+    indices : sequence of int
+        indices of the candidate structures
+    calculator : mlcalcdriver.calculators.EnsembleCalculator
+        committee of models, giving the prop + _std outputs
+    prop : str
+        energy or forces, property used to score the candidates
+    batch_size : int
+        (default : 256) number of candidates evaluated together
+
+    Returns:
+        numpy array of the scores, the standard deviation of the energy,
+        or the largest norm of the standard deviation of the forces
+    """
+    from mlcalcdriver import Posinp, Job
+
+    indices = np.asarray(indices)
+    scores = np.empty(len(indices))
+    for start in range(0, len(indices), batch_size):
+        batch = indices[start : start + batch_size]
+        posinps = [
+            Posinp.from_ase(displaced_structure(structure, displacement))
+            for displacement in displacements.batch(batch)
+        ]
+        job = Job(posinp=posinps, calculator=calculator)
+        job.run(prop, batch_size=batch_size)
+        std = np.array(job.results[prop + "_std"]).reshape(len(batch), -1)
+        if prop == "forces":
+            std = np.linalg.norm(std.reshape(len(batch), -1, 3), axis=2)
+        scores[start : start + len(batch)] = std.max(axis=1)
+    return scores
+
+
+def displaced_structure(structure, displacement):
+    r"""
+    Returns the displaced structure calculated by a job, as an ase.Atoms.
+    """
+    from utils.jobs.backends import posinp_to_atoms
+
+    if isinstance(structure, Atoms):
+        return displaced_atoms(structure, displacement)
+    return posinp_to_atoms(displaced_posinp(structure, displacement))
+
+
+def select_most_uncertain(indices, scores, k):
+    r"""
+    Returns the k indices with the highest scores, most uncertain first.
+    """
+    indices, scores = np.asarray(indices), np.asarray(scores)
+    k = min(k, len(indices))
+    top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+    return indices[top[np.argsort(-scores[top], kind="stable")]]
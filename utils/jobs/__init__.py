@@ -0,0 +1,4 @@
+from .scheduler import SlotScheduler
+from .workdir import JobDirectory
+from .manifest import JobManifest
+from .sink import ResultSink, CLEANUP_MODES
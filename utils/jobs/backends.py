@@ -0,0 +1,371 @@
+r"""
+Local stand-ins for the BigDFT and Abinit calculations, based on
+the ASE EMT and Lennard-Jones calculators. They write their results
+in the same files as the real codes, so the job orchestration,
+restart and ingestion paths can be run without the DFT executables.
+"""
+
+import os
+import numpy as np
+from functools import partial
+from ase import Atoms
+from ase.calculators.calculator import Calculator, all_changes
+from ase.units import Bohr, Hartree
+
+__all__ = [
+    "BACKENDS",
+    "BACKEND_HELP",
+    "read_input_params",
+    "bigdft_structure",
+    "get_calculator",
+    "get_bigdft_job",
+    "get_abinit_calculator",
+    "run_bigdft_job",
+    "LocalBigDFTJob",
+    "LocalAbinit",
+    "posinp_to_atoms",
+]
+
+BACKENDS = ["dft", "emt", "lj"]
+BACKEND_HELP = (
+    "Code used for the calculations. emt and lj are local stand-ins "
+    "writing the same output files, to test the workflow without DFT."
+)
+
+
+def get_calculator(backend):
+    r"""
+    Returns a new ASE calculator for a local backend.
+
+    Parameters:
+    ------------
+    backend : str
+        emt or lj
+    """
+    if backend == "emt":
+        from ase.calculators.emt import EMT
+
+        return EMT()
+    elif backend == "lj":
+        from ase.calculators.lj import LennardJones
+
+        return LennardJones(sigma=1.4, epsilon=0.1, rc=4.0)
+    else:
+        raise ValueError(
+            "The backend should be one of {}, not {}.".format(BACKENDS[1:], backend)
+        )
+
+
+def read_input_params(backend="dft"):
+    r"""
+    Returns the BigDFT input parameters of the first yaml file of the
+    current directory that can be read, the default ones otherwise.
+    The local backends have no input parameters and return None, so
+    mybigdft is only needed for the dft backend.
+    """
+    if backend != "dft":
+        return None
+    from mybigdft import InputParams
+
+    for filename in [f for f in os.listdir() if f.endswith(".yaml")]:
+        try:
+            return InputParams.from_file(filename)
+        except:
+            continue
+    return InputParams()
+
+
+def bigdft_structure(atoms, backend="dft"):
+    r"""
+    Returns the structure given to a BigDFT job for an ase.Atoms: a
+    mybigdft.Posinp for the dft backend, and the ase.Atoms itself for
+    the local backends, so mybigdft is not needed for them.
+    """
+    if backend != "dft":
+        return atoms
+    from mybigdft import Posinp
+
+    return Posinp.from_ase(atoms)
+
+
+def get_bigdft_job(backend="dft"):
+    r"""
+    Returns the class used to create BigDFT jobs, mybigdft.Job for
+    the dft backend and a LocalBigDFTJob otherwise.
+    """
+    if backend == "dft":
+        from mybigdft import Job
+
+        return Job
+    get_calculator(backend)
+    return partial(LocalBigDFTJob, backend=backend)
+
+
+def get_abinit_calculator(backend="dft"):
+    r"""
+    Returns the class used to create Abinit calculators, the ASE
+    Abinit calculator for the dft backend and a LocalAbinit otherwise.
+    """
+    if backend == "dft":
+        from ase.calculators.abinit import Abinit
+
+        return Abinit
+    get_calculator(backend)
+    return partial(LocalAbinit, backend=backend)
+
+
+def run_bigdft_job(job, **kwargs):
+    r"""
+    Runs a BigDFT job in its run_dir. mybigdft.Job writes its files in
+    the current directory and only moves to run_dir as a context manager,
+    so the job is entered for the run. The working directory is restored
+    at the end, and concurrent jobs run in separate processes of the
+    SlotScheduler, so each of them has its own working directory.
+    The keyword arguments are passed to job.run.
+    """
+    with job:
+        return job.run(**kwargs)
+
+
+class LocalBigDFTJob:
+    r"""
+    Stand-in for mybigdft.Job. Running the job writes the
+    forces_<name>.xyz file that BigDFT would have written, in the
+    current directory, like mybigdft.Job. Entering the job moves to
+    run_dir, so it should be run through run_bigdft_job.
+
+    Parameters:
+    ------------
+    name : str
+        name of the job
+    posinp : mybigdft.Posinp or ase.Atoms
+        structure to calculate
+    run_dir : str
+        (default : current directory) folder where the files are written
+    backend : str
+        (default : emt) local calculator, emt or lj
+    **kwargs :
+        other arguments of mybigdft.Job, ignored
+    """
+
+    def __init__(self, name="", posinp=None, run_dir=None, backend="emt", **kwargs):
+        self.name = name
+        self.posinp = posinp
+        self.run_dir = os.getcwd() if run_dir is None else run_dir
+        self.backend = backend
+
+    def __enter__(self):
+        self.init_dir = os.getcwd()
+        os.makedirs(self.run_dir, exist_ok=True)
+        os.chdir(self.run_dir)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        os.chdir(self.init_dir)
+
+    def run(self, nmpi=1, restart_if_incomplete=False, **kwargs):
+        atoms = posinp_to_atoms(self.posinp)
+        atoms.calc = get_calculator(self.backend)
+        energy = atoms.get_potential_energy()
+        forces = atoms.get_forces()
+        boundary_conditions = pbc_to_boundary_conditions(atoms.pbc)
+        write_bigdft_forces(
+            "forces_{}.xyz".format(self.name),
+            atoms,
+            boundary_conditions,
+            energy,
+            forces,
+        )
+        write_bigdft_log(
+            "log-{}.yaml".format(self.name), atoms, boundary_conditions, energy, forces
+        )
+
+
+class LocalAbinit(Calculator):
+    r"""
+    Stand-in for ase.calculators.abinit.Abinit. Each calculation
+    writes the <label>.txt output that Abinit would have written,
+    with the sections read by ase and abipy.
+
+    Parameters:
+    ------------
+    label : str
+        (default : abinit) prefix of the output file
+    backend : str
+        (default : emt) local calculator, emt or lj
+    **kwargs :
+        Abinit input variables, ignored
+    """
+
+    implemented_properties = ["energy", "forces"]
+
+    def __init__(self, label="abinit", backend="emt", **kwargs):
+        Calculator.__init__(self)
+        self.output = label + ".txt"
+        self.backend = backend
+
+    def calculate(self, atoms=None, properties=["energy"], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        at = self.atoms.copy()
+        at.calc = get_calculator(self.backend)
+        energy = at.get_potential_energy()
+        forces = at.get_forces()
+        write_abinit_output(self.output, self.atoms, energy, forces)
+        self.results = {"energy": energy, "forces": forces}
+
+
+def posinp_to_atoms(posinp):
+    r"""
+    Converts a mybigdft.Posinp to an ase.Atoms object. An ase.Atoms
+    is copied.
+    """
+    if isinstance(posinp, Atoms):
+        return posinp.copy()
+    factor = Bohr if posinp.units.lower().startswith("atomic") else 1.0
+    cell = np.array(posinp.cell, dtype=float)
+    if cell.ndim == 2:
+        cell = np.diag(cell)
+    cell[~np.isfinite(cell)] = 0.0
+    boundary_conditions = posinp.boundary_conditions
+    if boundary_conditions == "surface":
+        pbc = (True, False, True)
+    else:
+        pbc = boundary_conditions == "periodic"
+    return Atoms(
+        symbols=[atom.type for atom in posinp.atoms],
+        positions=np.array(posinp.positions, dtype=float) * factor,
+        cell=cell * factor,
+        pbc=pbc,
+    )
+
+
+def pbc_to_boundary_conditions(pbc):
+    pbc = tuple(bool(p) for p in pbc)
+    if all(pbc):
+        return "periodic"
+    elif pbc == (True, False, True):
+        return "surface"
+    elif not any(pbc):
+        return "free"
+    raise NotImplementedError("Periodic conditions {} are not supported.".format(pbc))
+
+
+def write_bigdft_log(filename, atoms, boundary_conditions, energy, forces):
+    r"""
+    Writes a minimal log-*.yaml file, with the structure, energy and
+    forces of a BigDFT logfile, so JobDirectory.bigdft_completed can
+    find the completed local jobs.
+    """
+    import yaml
+
+    symbols = atoms.get_chemical_symbols()
+    log = {
+        "Version Number": "local stand-in",
+        "Atomic structure": {
+            "units": "angstroem",
+            "cell": [float(c) for c in atoms.cell.lengths()],
+            "boundary_conditions": boundary_conditions,
+            "positions": [
+                {s: [float(x) for x in p]} for s, p in zip(symbols, atoms.positions)
+            ],
+        },
+        "Energy (Hartree)": float(energy / Hartree),
+        "Atomic Forces (Ha/Bohr)": [
+            {s: [float(x) for x in f]}
+            for s, f in zip(symbols, forces / Hartree * Bohr)
+        ],
+    }
+    with open(filename, "w") as f:
+        yaml.safe_dump(log, f, explicit_start=True, sort_keys=False)
+
+
+def write_bigdft_forces(filename, atoms, boundary_conditions, energy, forces):
+    r"""
+    Writes a forces_*.xyz file in the BigDFT format, with positions
+    in angstroem, energy in Hartree and forces in Hartree/Bohr.
+    """
+    lines = ["{} angstroem {:.15e} (Ha)".format(len(atoms), energy / Hartree)]
+    cell = atoms.cell.lengths()
+    if boundary_conditions == "free":
+        lines.append("free")
+    elif boundary_conditions == "surface":
+        lines.append("surface {:.15e} inf {:.15e}".format(cell[0], cell[2]))
+    else:
+        lines.append("periodic {:.15e} {:.15e} {:.15e}".format(*cell))
+    symbols = atoms.get_chemical_symbols()
+    for s, p in zip(symbols, atoms.positions):
+        lines.append("{} {:.15e} {:.15e} {:.15e}".format(s, *p))
+    lines.append(" forces")
+    for s, f in zip(symbols, forces / Hartree * Bohr):
+        lines.append("{} {:.15e} {:.15e} {:.15e}".format(s, *f))
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_abinit_output(filename, atoms, energy, forces):
+    r"""
+    Writes the parts of an Abinit output file read by ase
+    (abinit-out format) and abipy (AbinitOutputFile).
+    """
+    numbers = atoms.get_atomic_numbers()
+    znucl = np.unique(numbers)
+    typat = np.searchsorted(znucl, numbers) + 1
+
+    def values(array, fmt="{:.10E}"):
+        return " ".join(fmt.format(v) for v in np.asarray(array).reshape(-1))
+
+    def variables():
+        return [
+            "            acell   {}  Bohr".format(values(np.ones(3) / Bohr)),
+            "            natom   {}".format(len(atoms)),
+            "           ntypat   {}".format(len(znucl)),
+            "            rprim   {}".format(values(atoms.cell[:])),
+            "            typat   {}".format(values(typat, "{}")),
+            "           xangst   {}".format(values(atoms.positions)),
+            "            znucl   {}".format(values(znucl, "{:.2f}")),
+        ]
+
+    lines = [
+        ".Version 9.0.0 of ABINIT (local stand-in)",
+        "",
+        " -outvars: echo values of preprocessed input variables --------",
+    ]
+    lines += variables()
+    lines += [
+        "",
+        "=" * 80,
+        "",
+        " At SCF step    1, etot is converged :",
+        " ----iterations are completed or convergence reached----",
+        "",
+        " cartesian coordinates (angstrom) at end:",
+    ]
+    lines += [
+        "{:5} {}".format(i + 1, values(p, "{:21.14f}"))
+        for i, p in enumerate(atoms.positions)
+    ]
+    lines += ["", " cartesian forces (eV/Angstrom) at end:"]
+    lines += [
+        "{:5} {}".format(i + 1, values(f, "{:21.14f}")) for i, f in enumerate(forces)
+    ]
+    lines += [
+        "",
+        "--- !EnergyTerms",
+        "total_energy_eV    : {:.15e}".format(energy),
+        "...",
+        "",
+        "== END DATASET(S) " + "=" * 62,
+        "",
+        " -outvars: echo values of variables after computation  --------",
+    ]
+    lines += variables()
+    lines += [
+        "           etotal   {:.10E}".format(energy / Hartree),
+        "            fcart   {}".format(values(forces / Hartree * Bohr)),
+        "",
+        "=" * 80,
+        "",
+        " Calculation completed.",
+    ]
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
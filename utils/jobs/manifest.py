@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+__all__ = ["JobManifest"]
+
+
+class JobManifest:
+    r"""
+    SQLite database keeping the state of every job of a data generation
+    campaign, one row per job. Restarting a campaign is then a lookup
+    in the manifest instead of parsing the log of every job.
+
+    The database is opened in WAL mode and every update is its own
+    transaction, so jobs running in different processes can update
+    it concurrently. Only the path is kept on the object, which can
+    be sent to worker processes.
+
+    Parameters:
+    ------------
+    path : str
+        (default : run_dir/manifest.db) path to the manifest database
+    """
+
+    def __init__(self, path=os.path.join("run_dir", "manifest.db")):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "name TEXT PRIMARY KEY, "
+                "idx INTEGER, "
+                "seed TEXT, "
+                "status TEXT, "
+                "wall_time REAL, "
+                "result_path TEXT, "
+                "updated REAL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS status_index ON jobs(status)")
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=600)) as con:
+            with con:
+                yield con
+
+    def _set(
+        self, name, status, idx=None, seed=None, wall_time=None, result_path=None
+    ):
+        # Random seeds can be larger than sqlite integers
+        if seed is not None:
+            seed = str(seed)
+        with self._connect() as con:
+            con.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET "
+                "idx=COALESCE(excluded.idx, idx), "
+                "seed=COALESCE(excluded.seed, seed), "
+                "status=excluded.status, "
+                "wall_time=COALESCE(excluded.wall_time, wall_time), "
+                "result_path=COALESCE(excluded.result_path, result_path), "
+                "updated=excluded.updated",
+                (name, idx, seed, status, wall_time, result_path, time.time()),
+            )
+
+    def status(self, name):
+        r"""
+        Returns the status of a job, None if it is not in the manifest.
+        """
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT status FROM jobs WHERE name=?", (name,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def is_completed(self, name):
+        return self.status(name) == "completed"
+
+    def completed(self):
+        r"""
+        Returns the set of the names of the completed jobs.
+        """
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT name FROM jobs WHERE status='completed'"
+            ).fetchall()
+        return set(row[0] for row in rows)
+
+    def set_completed(self, name, idx=None, seed=None, result_path=None):
+        r"""
+        Marks a job as completed without timing it, for jobs
+        found completed on disk.
+        """
+        self._set(name, "completed", idx=idx, seed=seed, result_path=result_path)
+
+    @contextmanager
+    def track(self, name, idx=None, seed=None, result_path=None):
+        r"""
+        Context manager marking a job as running, then as completed
+        with its wall time, or as failed if an exception is raised.
+
+        Parameters:
+        ------------
+        name : str
+            name of the job
+        idx : int
+            (default : None) index of the structure
+        seed : int
+            (default : None) seed used to generate the structure
+        result_path : str
+            (default : None) path of the saved result file
+        """
+        self._set(name, "running", idx=idx, seed=seed)
+        start = time.time()
+        try:
+            yield
+        except BaseException:
+            self._set(name, "failed", wall_time=time.time() - start)
+            raise
+        self._set(
+            name,
+            "completed",
+            wall_time=time.time() - start,
+            result_path=result_path,
+        )
+
+    def summary(self):
+        r"""
+        Returns the number of jobs for each status.
+        """
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
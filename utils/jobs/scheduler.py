@@ -0,0 +1,75 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+__all__ = ["SlotScheduler"]
+
+
+class SlotScheduler:
+    r"""
+    Runs independent DFT jobs concurrently. The cores of the node are
+    split in slots of nmpi * nomp cores, and a new job is started as soon
+    as a slot is free. Each slot is a separate process, with its own
+    working directory and random state.
+
+    Parameters:
+    ------------
+    n_cores : int
+        (default : None) number of cores to use, all of them if None
+    nmpi : int
+        (default : 1) number of mpi processes per job
+    nomp : int
+        (default : 1) number of OpenMP threads per mpi process
+    """
+
+    def __init__(self, n_cores=None, nmpi=1, nomp=1):
+        self.n_cores = os.cpu_count() if n_cores is None else int(n_cores)
+        self.nmpi = int(nmpi)
+        self.nomp = int(nomp)
+        self.n_slots = max(1, self.n_cores // (self.nmpi * self.nomp))
+
+    def run(self, function, tasks):
+        r"""
+        Calls function(*task) for every task, keeping every slot busy.
+        A failed job does not stop the others; the failures are
+        reported once all the jobs are done.
+        """
+        tasks = iter(tasks)
+        cwd = os.getcwd()
+        running, failed = {}, []
+        print("Running jobs in {} slots.".format(self.n_slots))
+        with ProcessPoolExecutor(
+            max_workers=self.n_slots, initializer=_init_slot, initargs=(self.nomp,)
+        ) as executor:
+            while True:
+                # Keep a few jobs in the queue so slots never wait
+                while len(running) < 2 * self.n_slots:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    running[executor.submit(_run_task, cwd, function, task)] = task
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if future.exception() is not None:
+                        print("Job {} failed: {}".format(task[0], future.exception()))
+                        failed.append(task[0])
+        if failed:
+            raise RuntimeError("{} jobs failed: {}".format(len(failed), failed))
+
+
+def _init_slot(nomp):
+    os.environ["OMP_NUM_THREADS"] = str(nomp)
+    # Forked processes share the random state of the parent
+    np.random.seed()
+
+
+def _run_task(cwd, function, task):
+    # A failed job can leave the process in its job directory
+    os.chdir(cwd)
+    try:
+        return function(*task)
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,95 @@
+import os
+from ase.db import connect
+from utils.global_variables import DEFAULT_METADATA
+
+__all__ = ["ResultSink", "CLEANUP_MODES"]
+
+CLEANUP_MODES = ["keep", "remove", "archive"]
+
+
+class ResultSink:
+    r"""
+    Collects the result of each DFT job as soon as it finishes. The
+    energy and forces are parsed once and written to a results database,
+    then the job directory can be removed or archived.
+
+    The database is in WAL mode, and every result is written in its own
+    transaction, so jobs running in separate processes can write to it
+    concurrently. Only names are kept on the object, which can be
+    sent to worker processes.
+
+    Parameters:
+    ------------
+    dbname : str
+        (default : None) results database, no database is written if None
+    cleanup : str
+        (default : keep) what to do with the job directory once its
+        results are saved, keep, remove or archive
+    metadata : dict
+        (default : DEFAULT_METADATA) metadata of a new database
+    """
+
+    def __init__(self, dbname=None, cleanup="keep", metadata=DEFAULT_METADATA):
+        if cleanup not in CLEANUP_MODES:
+            raise ValueError("The cleanup should be one of {}.".format(CLEANUP_MODES))
+        self.dbname = None if dbname is None else os.path.abspath(dbname)
+        self.cleanup = cleanup
+        if self.dbname is not None:
+            db = connect(self.dbname)
+            with db:
+                db.connection.execute("PRAGMA journal_mode=WAL")
+            if not db.metadata:
+                db.metadata = metadata
+
+    def collect(self, workdir, filename, code, **kvp):
+        r"""
+        Writes the results of a finished job to the database, then
+        cleans its directory.
+
+        Parameters:
+        ------------
+        workdir : utils.jobs.JobDirectory
+            directory of the finished job
+        filename : str
+            name of the output file, in the job directory
+        code : str
+            bigdft or abinit, format of the output file
+        **kvp :
+            key-value pairs written with the row
+        """
+        if self.dbname is not None:
+            atoms, data = read_output(workdir.file(filename), code)
+            self.write(atoms, data, job=workdir.name, **kvp)
+        if self.cleanup == "remove":
+            workdir.remove()
+        elif self.cleanup == "archive":
+            workdir.archive()
+
+    def write(self, atoms, data, job, **kvp):
+        r"""
+        Writes a result to the database. The row of a job that was
+        already written is replaced, so restarted jobs are not duplicated.
+        """
+        db = connect(self.dbname)
+        with db:
+            ids = [row.id for row in db.select(job=job, include_data=False)]
+            if ids:
+                return db.write(atoms, data=data, id=ids[0], job=job, **kvp)
+            return db.write(atoms, data=data, job=job, **kvp)
+
+
+def read_output(filename, code):
+    from utils.parsers import (
+        read_abinit_output,
+        read_bigdft_forces,
+        bigdft_forces_to_atoms,
+    )
+
+    if code == "bigdft":
+        results = read_bigdft_forces(filename)
+        atoms = bigdft_forces_to_atoms(results)
+        return atoms, {"energy": results["energy"], "forces": results["forces"]}
+    elif code == "abinit":
+        return read_abinit_output(filename)
+    else:
+        raise ValueError("The code should be bigdft or abinit, not {}.".format(code))
@@ -0,0 +1,98 @@
+import os
+import tarfile
+from shutil import copyfile, rmtree
+
+__all__ = ["JobDirectory"]
+
+
+class JobDirectory:
+    r"""
+    Working directory of a single DFT job. Every path is absolute, so
+    jobs can be prepared, run and checked without changing the working
+    directory of the process.
+
+    Parameters:
+    ------------
+    name : str
+        name of the job directory, inside run_dir
+    result_name : str
+        name of the saved result file, inside results_dir
+    run_dir : str
+        (default : run_dir) folder containing the job directories
+    results_dir : str
+        (default : saved_results) folder containing the saved results
+    """
+
+    def __init__(
+        self, name, result_name, run_dir="run_dir", results_dir="saved_results"
+    ):
+        self.name = str(name)
+        self.path = os.path.join(os.path.abspath(run_dir), self.name)
+        self.result_path = os.path.join(os.path.abspath(results_dir), result_name)
+
+    def create(self):
+        r"""
+        Creates the directory. Returns False if it already existed.
+        """
+        try:
+            os.makedirs(self.path)
+            return True
+        except FileExistsError:
+            return False
+
+    def file(self, filename):
+        return os.path.join(self.path, filename)
+
+    def clear(self):
+        for f in os.listdir(self.path):
+            os.remove(self.file(f))
+
+    def remove(self):
+        rmtree(self.path, ignore_errors=True)
+
+    def archive(self, archive_dir=None):
+        r"""
+        Compresses the directory to archive_dir/<name>.tar.gz, then
+        removes it. The default archive_dir is run_dir/archive.
+        """
+        if archive_dir is None:
+            archive_dir = os.path.join(os.path.dirname(self.path), "archive")
+        os.makedirs(archive_dir, exist_ok=True)
+        with tarfile.open(
+            os.path.join(archive_dir, self.name + ".tar.gz"), "w:gz"
+        ) as tar:
+            tar.add(self.path, arcname=self.name)
+        self.remove()
+
+    def save(self, filename):
+        r"""
+        Copies a file of the job directory to the saved result path.
+        """
+        copyfile(self.file(filename), self.result_path)
+
+    def bigdft_completed(self, jobname):
+        logname = self.file("log-" + jobname + ".yaml")
+        try:
+            from mybigdft import Logfile
+        except ImportError:
+            # Without mybigdft, as with the local backends, the
+            # log only has to contain the final energy
+            Logfile = None
+        try:
+            if Logfile is None:
+                import yaml
+
+                with open(logname, "r") as f:
+                    return "Energy (Hartree)" in yaml.safe_load(f)
+            Logfile.from_file(logname)
+            return True
+        except Exception:
+            return False
+
+    def abinit_completed(self):
+        from abipy.abio.outputs import AbinitOutputFile
+
+        try:
+            return bool(AbinitOutputFile(self.file("abinit.out")).run_completed)
+        except Exception:
+            return False
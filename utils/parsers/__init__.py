@@ -0,0 +1,2 @@
+from .bigdft import read_bigdft_forces, bigdft_forces_to_atoms
+from .abinit import read_abinit_output
@@ -0,0 +1,38 @@
+r"""
+Parser for the output files written by Abinit
+"""
+
+import numpy as np
+from ase.io import read
+
+__all__ = ["read_abinit_output"]
+
+HA_TO_EV = 27.21138602
+BOHR_TO_ANG = 0.529177249
+
+
+def read_abinit_output(filename):
+    r"""
+    Reads the final structure, energy and forces of an Abinit output file.
+
+    Parameters:
+    ------------
+    filename : str
+        path to the abinit.out file
+
+    Returns:
+        ase.Atoms of the final structure, and a dict with keys
+        energy : float, in eV
+        forces : (n_atoms, 3) array, in eV/angstroem
+    """
+    from abipy.abio.outputs import AbinitOutputFile
+
+    atoms = read(filename, format="abinit-out")
+    about = AbinitOutputFile(filename)
+    energy = float(about.final_vars_global["etotal"]) * HA_TO_EV
+    forces = (
+        np.array(about.final_vars_global["fcart"].split(), dtype=float).reshape(-1, 3)
+        * HA_TO_EV
+        / BOHR_TO_ANG
+    )
+    return atoms, {"energy": energy, "forces": forces}
@@ -0,0 +1,135 @@
+r"""
+Single pass parser for the forces_*.xyz files written by BigDFT
+"""
+
+import numpy as np
+from ase import Atoms
+from ase.units import Bohr
+
+__all__ = ["read_bigdft_forces", "bigdft_forces_to_atoms"]
+
+HA_TO_EV = 27.21138602
+BOHR_TO_ANG = 0.529177249
+
+LENGTH_UNITS = {
+    "angstroem": 1.0,
+    "angstroemd0": 1.0,
+    "angstrom": 1.0,
+    "angstromd0": 1.0,
+    "atomic": Bohr,
+    "atomicd0": Bohr,
+    "bohr": Bohr,
+    "bohrd0": Bohr,
+    "reduced": Bohr,
+    "reducedd0": Bohr,
+}
+
+
+def read_bigdft_forces(filename):
+    r"""
+    Reads a BigDFT forces file in a single pass. The position and
+    force blocks are parsed in bulk by numpy.
+
+    Parameters:
+    ------------
+    filename : str
+        path to the forces_*.xyz file
+
+    Returns:
+        dict with keys
+        species : numpy array of str
+        positions : (n_atoms, 3) array, in angstroem. Reduced positions
+            are scaled by the cell in its periodic directions
+        cell : (3,) array of the cell lengths, in angstroem
+        boundary_conditions : str, free, surface or periodic
+        energy : float, in eV
+        forces : (n_atoms, 3) array, in eV/angstroem,
+            None if the file has no forces block
+    """
+    with open(filename, "r") as f:
+        lines = f.read().splitlines()
+
+    header = lines[0].split()
+    natoms, units = int(header[0]), header[1].lower()
+    if units not in LENGTH_UNITS:
+        raise NotImplementedError("Units {} are not supported.".format(units))
+    factor = LENGTH_UNITS[units]
+    energy = float(header[2]) * HA_TO_EV
+
+    bc_line = lines[1].split()
+    boundary_conditions = bc_line[0].lower()
+    if boundary_conditions == "free":
+        cell = np.zeros(3)
+    else:
+        cell = np.array(bc_line[1:4], dtype=float)
+        cell[~np.isfinite(cell)] = 0.0
+        cell = cell * factor
+
+    positions_block = lines[2 : 2 + natoms]
+    species = np.loadtxt(positions_block, usecols=0, dtype=str, ndmin=1)
+    positions = np.loadtxt(positions_block, usecols=(1, 2, 3), ndmin=2).reshape(
+        natoms, 3
+    )
+    if units.startswith("reduced"):
+        # The cell is given in bohr and the non-periodic direction of a surface
+        # is not reduced
+        if boundary_conditions == "free":
+            raise ValueError("Reduced units need a periodic cell.")
+        periodic = np.ones(3, dtype=bool)
+        if boundary_conditions == "surface":
+            periodic[1] = False
+        positions = np.where(periodic, positions * cell, positions * factor)
+    else:
+        positions = positions * factor
+
+    forces = None
+    for i in range(2 + natoms, len(lines)):
+        if "forces" in lines[i]:
+            forces_block = lines[i + 1 : i + 1 + natoms]
+            forces = (
+                np.loadtxt(forces_block, usecols=(1, 2, 3), ndmin=2).reshape(natoms, 3)
+                * HA_TO_EV
+                / BOHR_TO_ANG
+            )
+            break
+
+    return {
+        "species": species,
+        "positions": positions,
+        "cell": cell,
+        "boundary_conditions": boundary_conditions,
+        "energy": energy,
+        "forces": forces,
+    }
+
+
+def bigdft_forces_to_atoms(results):
+    r"""
+    Builds an ase.Atoms object from the output of read_bigdft_forces.
+    The masses are the ones of mlcalcdriver, like posinp_to_ase_atoms,
+    or the ASE defaults if mlcalcdriver is not installed.
+    """
+    try:
+        from mlcalcdriver.globals import ATOMS_MASS
+
+        masses = [ATOMS_MASS[species] for species in results["species"]]
+    except ImportError:
+        masses = None
+    boundary_conditions = results["boundary_conditions"]
+    if boundary_conditions == "free":
+        pbc = False
+    elif boundary_conditions == "surface":
+        pbc = (True, False, True)
+    elif boundary_conditions == "periodic":
+        pbc = True
+    else:
+        raise NotImplementedError(
+            "Boundary conditions {} are not supported.".format(boundary_conditions)
+        )
+    return Atoms(
+        symbols=list(results["species"]),
+        positions=results["positions"],
+        masses=masses,
+        cell=results["cell"],
+        pbc=pbc,
+    )